@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+efficiency: one design at a time vs batched (stacked design matrices, cholesky)
+
+  python3 bench/bench_efficiency.py
+"""
+import timeit
+import genTaskTime as gtt
+from genTaskTime.efficiency import Efficiency
+from genTaskTime.TrialList import triallist_to_df
+
+DESC = ("<300/40 @2 glt:d=cue_A-cue_B> " +
+        "cue=[1.5](A,B)@BLOCK; dly=[1,2,3]; dot=[1.5](left,right)@GAM")
+NCAND = 2000
+
+if __name__ == '__main__':
+    (last_leaves, settings) = gtt.str_to_last_leaves(DESC, verb=0)
+    design = gtt.FittedDesign(last_leaves, settings, verb=0)
+    eff = Efficiency(last_leaves, settings)
+    edfs = [triallist_to_df(design.draw(i)[0], 0) for i in range(NCAND)]
+
+    single = timeit.timeit(lambda: [eff.efficiency(e) for e in edfs[:200]], number=1) / 200
+    batch = timeit.timeit(lambda: eff.batch_efficiency(edfs), number=1) / NCAND
+    print("%-10s %8.0f designs/s" % ("single", 1 / single))
+    print("%-10s %8.0f designs/s" % ("batch", 1 / batch))
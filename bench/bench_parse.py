@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+parse latency: recompiling GRAMMAR every call (old behavior)
+vs the lazily compiled parser vs the cached AST lookup
+
+  python3 bench/bench_parse.py
+"""
+import timeit
+import tatsu
+from genTaskTime.EventGrammar import GRAMMAR, compiled_grammar, parse, _parse_normalized
+
+DESC = "<300/40> ring=[1.5](rew,neu){.333}; prep=[1.5]{.333}; dot=[1.5](left,right)"
+
+
+def report(label, func, number):
+    secs = timeit.timeit(func, number=number) / number
+    print("%-28s %10.3f ms/parse" % (label, secs * 1000))
+    return secs
+
+
+if __name__ == '__main__':
+    before = report("tatsu.parse(GRAMMAR, ...)",
+                    lambda: tatsu.parse(GRAMMAR, DESC), 5)
+
+    model = compiled_grammar()
+    compiled = report("compiled model.parse", lambda: model.parse(DESC), 20)
+
+    _parse_normalized.cache_clear()
+    parse(DESC)
+    cached = report("parse (cached)", lambda: parse(DESC), 10000)
+
+    print("speedup: compiled %.0fx, cached %.0fx" %
+          (before / compiled, before / cached))
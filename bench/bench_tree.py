@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+events_to_tree build time as factorial designs grow.
+time per created node should stay flat (linear build) up to 10^5 leaves
+
+  python3 bench/bench_tree.py
+  python3 bench/bench_tree.py -l 10 100 1000 -r 5
+"""
+import argparse
+import time
+import genTaskTime as gtt
+
+
+def factorial_desc(nleaves: int) -> str:
+    """
+    cue crossed with three factors (about nleaves**(1/3) levels each)
+    followed by a few sequential events
+    """
+    nlev = max(2, round(nleaves ** (1 / 3)))
+    factors = " * ".join(",".join("%s%d" % (f, i) for i in range(nlev)) for f in "ABC")
+    return "<1/1> cue=[1](%s); dly=[1,2]; prb=[1]; fb=[1]" % factors
+
+
+def time_build(desc: str, repeat: int) -> tuple[float, int, int]:
+    """
+    @return (best seconds for events_to_tree, nodes created, leaves)
+    parse is not timed (and is cached)
+    """
+    events = gtt.parse_events(gtt.parse(desc))
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        leaves = gtt.events_to_tree(events, verb=0)
+        best = min(best, time.perf_counter() - start)
+    nnodes = 1 + len(leaves[0].root.descendants)
+    return (best, nnodes, len(leaves))
+
+
+if __name__ == '__main__':
+    getargs = argparse.ArgumentParser(description="time events_to_tree")
+    getargs.add_argument('-l', '--leaves', type=int, nargs='+',
+                         default=[10, 100, 1000, 10000, 100000])
+    getargs.add_argument('-r', '--repeat', type=int, default=3)
+    args = getargs.parse_args()
+
+    print("%10s %10s %10s %12s" % ("leaves", "nodes", "ms", "us/node"))
+    for n in args.leaves:
+        (secs, nnodes, nleaves) = time_build(factorial_desc(n), args.repeat)
+        print("%10d %10d %10.1f %12.2f" % (nleaves, nnodes, secs * 1000, secs / nnodes * 1e6))
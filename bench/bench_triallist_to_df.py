@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+triallist_to_df: per event python loop (old) vs flat arrays + cumsum
+on a trial list with single slot itis (worst case) and pooled itis
+
+list of dict input is bound by reading each dict, so cumsum only gains
+~1.1x (single slot) to ~1.7x (pooled). a TrialArray (what -n draws)
+skips the dicts: ~7x and ~3x.
+
+  python3 bench/bench_triallist_to_df.py
+"""
+import timeit
+import pandas as pd
+from genTaskTime.TrialList import triallist_to_df, iti_trial
+from genTaskTime.TrialArray import TrialArray
+
+
+def triallist_to_df_loop(triallist, start_at_time):
+    "triallist_to_df before vectorizing. for comparison"
+    events = []
+    total_time = start_at_time
+    for tt in triallist:
+        for t in tt:
+            name = "_".join(t["fname"]) if t["fname"] else "__iti__"
+            if (
+                name == "__iti__"
+                and len(events) > 0
+                and events[-1]["event"] == "__iti__"
+            ):
+                events[-1]["dur"] += t["dur"]
+            else:
+                events.append({"event": name, "onset": total_time, "dur": t["dur"]})
+            total_time += t["dur"]
+    return pd.DataFrame(events)
+
+
+def make_triallist(ntrials, slots_per_trial, granule):
+    trial = [{"fname": ["cue", "A"], "dur": 1.5, "type": "event"},
+             {"fname": ["dly"], "dur": 3, "type": "event"},
+             {"fname": None, "dur": 1, "type": "iti"}]
+    if granule:
+        iti = [[{"fname": None, "dur": .01, "type": "iti"}]] * slots_per_trial
+    else:
+        iti = [iti_trial(slots_per_trial, .01)]
+    return [x for _ in range(ntrials) for x in [trial] + iti]
+
+
+def report(label, func, number):
+    secs = timeit.timeit(func, number=number) / number
+    print("%-34s %10.3f ms" % (label, secs * 1000))
+    return secs
+
+
+if __name__ == '__main__':
+    for granule in [True, False]:
+        tl = make_triallist(100, 500, granule)
+        ta = TrialArray.from_triallist(tl, .01)
+        nevents = sum(len(t) for t in tl)
+        label = "single slot itis" if granule else "pooled itis"
+        print("# %s: %d events" % (label, nevents))
+        old = report("loop", lambda: triallist_to_df_loop(tl, 0), 5)
+        new = report("cumsum", lambda: triallist_to_df(tl, 0), 5)
+        arr = report("cumsum (TrialArray)", lambda: triallist_to_df(ta, 0), 5)
+        assert triallist_to_df_loop(tl, 0).equals(triallist_to_df(tl, 0))
+        assert triallist_to_df_loop(tl, 0).equals(triallist_to_df(ta, 0))
+        print("speedup %.1fx list, %.1fx TrialArray" % (old / new, old / arr))
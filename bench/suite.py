@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+time each stage of making an iteration for a few representative task descriptions.
+results go to a json file so runs (commits) can be compared
+
+  python3 bench/suite.py                        # all cases -> bench_results.json
+  python3 bench/suite.py -c factorial -r 5 -o new.json
+  python3 bench/suite.py --compare old.json     # also print new/old ratio
+
+stages
+  parse     parse DSL (cache cleared)
+  tree      events_to_tree (str_to_last_leaves with a cached parse)
+  fit       FittedDesign: fit_tree and duration pools
+  triallist redraw durations, event_tree_to_list, add_itis
+  shuffle   shuffle_triallist (trial order and itis)
+  df        triallist_to_df
+  1D        df_to_1D
+  write     write_event_df (tsv and 1D files)
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import genTaskTime as gtt
+from genTaskTime.EventGrammar import _parse_normalized
+from genTaskTime.TrialList import shuffle_triallist, triallist_to_df, df_to_1D, write_event_df
+
+CASES = {
+    # readme example for lncdtask's dollarreward. has catch trials
+    "dollarreward": "<300/40> ring=[1.5](rew,neu){.333}; prep=[1.5]{.333}; dot=[1.5](left,right)",
+    # 16 leaves
+    "factorial": "<1200/192> cue=[1](A,B,C,D * N,F * X,Y); dly=[1,2]; fb=[1]",
+    # 1 hour at .01s: many iti slots
+    "hour_fine": "<3600/400 stepsize:.01> cue=[1.5](A,B); isi=[1.5-5 u]; resp=[2]",
+    # little room between miniti and maxiti
+    "tight_iti": "<300/50 iti:1-2> cue=[1.5](A,B); dly=[1,2]; end=[1]",
+}
+STAGES = ["parse", "tree", "fit", "triallist", "shuffle", "df", "1D", "write"]
+
+
+def time_stage(setup, run, repeat: int) -> dict:
+    """
+    @param setup  called before each run, not timed. returns run's argument
+    @param run    timed
+    @return seconds per call: best, median, mean and how many calls
+    """
+    secs = []
+    for i in range(repeat):
+        arg = setup(i)
+        start = time.perf_counter()
+        run(arg)
+        secs.append(time.perf_counter() - start)
+    return {"best": min(secs), "median": statistics.median(secs),
+            "mean": statistics.fmean(secs), "n": repeat}
+
+
+def bench_case(desc: str, repeat: int, outdir: str) -> dict:
+    "time every stage for one task description"
+    (last_leaves, settings) = gtt.str_to_last_leaves(desc, verb=0)
+    design = gtt.FittedDesign(last_leaves, settings, verb=0)
+    start = settings.get("startpad", 0)
+
+    def unshuffled(i):
+        return (design.triallist(np.random.default_rng(i)), random.Random(i))
+
+    def shuffled(i):
+        (tl, myrand) = unshuffled(i)
+        return shuffle_triallist(settings, tl, i, myrand=myrand)[0]
+
+    def edf(i):
+        return triallist_to_df(shuffled(i), start)
+
+    def parse_uncached(_):
+        _parse_normalized.cache_clear()
+
+    res = {
+        "parse": time_stage(parse_uncached, lambda _: gtt.parse(desc), repeat),
+        "tree": time_stage(lambda i: None, lambda _: gtt.str_to_last_leaves(desc, verb=0), repeat),
+        "fit": time_stage(lambda i: gtt.str_to_last_leaves(desc, verb=0),
+                          lambda t: gtt.FittedDesign(*t, verb=0), repeat),
+        "triallist": time_stage(np.random.default_rng, design.triallist, repeat),
+        "shuffle": time_stage(unshuffled,
+                              lambda a: shuffle_triallist(settings, a[0], 0, myrand=a[1]),
+                              repeat),
+        "df": time_stage(shuffled, lambda tl: triallist_to_df(tl, start), repeat),
+        "1D": time_stage(edf, lambda e: df_to_1D(e, os.path.join(outdir, "1D")), repeat),
+        "write": time_stage(edf, lambda e: write_event_df(e, os.path.join(outdir, "write")),
+                            repeat),
+    }
+    return res
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(results: dict, old: dict | None = None) -> None:
+    "median ms per stage, case per row. with old: new/old ratio in ()"
+    print("%-14s" % "case" + "".join("%14s" % s for s in STAGES))
+    for case, stages in results.items():
+        cells = []
+        for stage in STAGES:
+            ms = stages[stage]["median"] * 1000
+            cell = "%.2f" % ms
+            prev = (old or {}).get(case, {}).get(stage)
+            if prev:
+                cell += " (%.2f)" % (stages[stage]["median"] / prev["median"])
+            cells.append("%14s" % cell)
+        print("%-14s" % case + "".join(cells))
+
+
+if __name__ == '__main__':
+    getargs = argparse.ArgumentParser(description="time genTaskTime stages")
+    getargs.add_argument('-c', '--case', dest='cases', nargs='+', choices=list(CASES),
+                         default=list(CASES))
+    getargs.add_argument('-r', '--repeat', type=int, default=20,
+                         help="timed calls per stage (default=20)")
+    getargs.add_argument('-o', dest='output', default='bench_results.json')
+    getargs.add_argument('--compare', default=None, help="earlier results json")
+    args = getargs.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        for case in args.cases:
+            # fitting and shuffling print warnings (catch trials, durations)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[case] = bench_case(CASES[case], args.repeat, outdir)
+
+    record = {
+        "meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                 "commit": git_commit(),
+                 "python": platform.python_version(),
+                 "numpy": np.__version__,
+                 "pandas": pd.__version__,
+                 "machine": platform.machine(),
+                 "repeat": args.repeat},
+        "cases": {case: CASES[case] for case in args.cases},
+        "results": results,
+    }
+    with open(args.output, "w") as fh:
+        json.dump(record, fh, indent=1)
+
+    old = None
+    if args.compare:
+        with open(args.compare) as fh:
+            old = json.load(fh)["results"]
+    print("median ms per call" + (" (new/old)" if old else ""))
+    print_table(results, old)
+    print("wrote %s" % args.output)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import functools
 import tatsu
 # parse a string to design an experiment
 # example:
@@ -170,8 +171,41 @@ def unlist_grammar(e):
     return final
 
 
+# compiling GRAMMAR is by far the slowest part of parsing. do it once (lazily)
+# and keep a bounded cache of ASTs for descriptions we have already seen
+_PARSER = None
+PARSE_CACHE_SIZE = 256
+
+
+def compiled_grammar():
+    """
+    tatsu model for GRAMMAR. compiled on first use and reused after
+    """
+    global _PARSER
+    if _PARSER is None:
+        _PARSER = tatsu.compile(GRAMMAR)
+    return _PARSER
+
+
+def normalize_desc(timingdesc: str) -> str:
+    """
+    collapse whitespace so equivalent descriptions share a cache entry.
+    grammar skips whitespace, so this does not change the parse
+    """
+    return " ".join(timingdesc.split())
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_normalized(timingdesc: str):
+    return compiled_grammar().parse(timingdesc)
+
+
 def parse(timingdesc):
-    return(tatsu.parse(GRAMMAR, timingdesc))
+    """
+    parse a timing description into an AST.
+    results are cached: treat the returned AST as read only
+    """
+    return(_parse_normalized(normalize_desc(timingdesc)))
 
 
 def parse_settings(astobj):
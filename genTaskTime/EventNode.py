@@ -1,26 +1,19 @@
 import anytree
 import random
+import numpy as np
 from .EventGrammar import unlist_grammar
 from .badmath import (zeno_dichotomy, fit_dist, list_to_length_n,
-                      rep_a_b_times, print_uniq_c)
+                      rep_a_b_array, print_uniq_c)
 
 
-def gen_dist(steps, freq, nsamples, dist, parseid="gen_dist"):
+def gen_pool(steps, freq, nsamples, dist) -> np.ndarray:
     """
-    generate distirubtion
+    deterministic part of gen_dist: steps repeated by (fit) frequency
     """
     # if we have an int, make it a list
     if type(steps) == int:
         steps = [steps]
 
-    # how many steps
-    ndur = len(steps)
-
-    # the warning message we want to send (if we need to)
-    msg = ("WARNING: %s: num durations given (%d)" +
-           "doesn't fit with number of events (%d) equally. " +
-           "randomly picking") % (parseid, ndur, nsamples)
-
     if dist == 'g':
         if freq is not None and any([x != 1 for x in freq]):
             print("WARNING: asked for distribution, but provided frequences" +
@@ -30,10 +23,25 @@ def gen_dist(steps, freq, nsamples, dist, parseid="gen_dist"):
         freq = fit_dist(len(steps), dist_array, nsamples)
 
     # elif dist == 'e':
-    steps = rep_a_b_times(steps, freq)
+    return rep_a_b_array(steps, freq).astype(float)
+
+
+def pool_msg(pool, nsamples, parseid):
+    "the warning message we want to send (if we need to)"
+    return ("WARNING: %s: num durations given (%d)" +
+            "doesn't fit with number of events (%d) equally. " +
+            "randomly picking") % (parseid, len(pool), nsamples)
+
+
+def gen_dist(steps, freq, nsamples, dist, parseid="gen_dist", myrand=random):
+    """
+    generate distirubtion
+    """
+    steps = gen_pool(steps, freq, nsamples, dist).tolist()
     #print('%s: initial dur before resample: %s' % (parseid, steps))
 
-    dur = list_to_length_n(steps, nsamples, msg)
+    msg = pool_msg(steps, nsamples, parseid)
+    dur = list_to_length_n(steps, nsamples, msg, myrand)
     return(dur)
 
 
@@ -110,9 +118,21 @@ class EventNode(anytree.NodeMixin):
             node.branch_reps = branch_reps
         return node.branch_reps
 
+    def parse_dur(self, nperms, rng: np.random.Generator | None = None):
+        """
+        build the duration pool (fit_dur) and draw from it (draw_dur)
+        """
+        self.fit_dur(nperms)
+        return self.draw_dur(rng)
+
     # TODO: better handle distibutions
-    # TODO: parse_dur every iteration
-    def parse_dur(self, nperms):
+    def fit_dur(self, nperms):
+        """
+        deterministic part of parse_dur. only depends on the fitted tree
+        sets dur_pool (values to draw from) and dur_nsamples (how many to draw)
+        as well as dur_base (pool repeated to fit in nsamples) and
+        dur_extra (how many more to pick at random from the pool each draw)
+        """
         # ## how many durs do we need?
         # -- should probably stop if do not have total_reps
         nsamples = getattr(self, "master_total_reps",
@@ -141,10 +161,10 @@ class EventNode(anytree.NodeMixin):
                 print('unknown distribution, using uniform')
 
         if type(self.dur) in [float, int, type(None)]:
-            dur = [self.dur] * nsamples
+            pool = np.full(nsamples, float(self.dur or 0))
 
         elif self.dur['dur']:
-            dur = [float(self.dur['dur'])] * int(nsamples)
+            pool = np.full(int(nsamples), float(self.dur['dur']))
 
         elif self.dur['min']:
             # todo distribute for others (just uniform now)
@@ -152,53 +172,76 @@ class EventNode(anytree.NodeMixin):
             b = float(self.dur['max'])
             # TODO: round intv w.r.t granularity
             if dist == 'u':
-                intv = (b-a)/(nsamples-1)
-                dur = [a+i*intv for i in range(nsamples)]
+                pool = np.linspace(a, b, nsamples)
             else:
                 freqs = zeno_dichotomy(nsamples)
-                intv = (b-a)/(len(freqs)-1)
-                nums = [a+i*intv for i in range(len(freqs))]
-                dur = gen_dist(nums, None, nsamples, dist, self.name)
+                nums = np.linspace(a, b, len(freqs)).tolist()
+                pool = gen_pool(nums, None, nsamples, dist)
 
         elif self.dur['steps']:
             steps = unlist_grammar(self.dur['steps'])
             nums = [float(x['num']) for x in steps]
             freqs = [x['freq'] if x['freq'] is not None else 1 for x in steps]
-            dur = gen_dist(nums, freqs, nsamples, dist, self.name)
+            pool = gen_pool(nums, freqs, nsamples, dist)
             if self.verbose > 10:
                 print('have steps %s' % nums)
                 print('into freqs %s' % freqs)
                 print('total n %s' % nsamples)
-                print('final durs %s' % dur)
+                print('pool durs %s' % pool)
+
+        self.dur_pool = pool
+        self.dur_nsamples = nsamples
+        # like list_to_length_n: whole copies of the pool + a random part of one more
+        npool = len(pool)
+        if npool == nsamples or npool == 0:
+            (self.dur_base, self.dur_extra) = (pool, 0)
+        else:
+            if self.verbose > 1:
+                print(pool_msg(pool, nsamples, self.name))
+            (self.dur_base, self.dur_extra) = (np.tile(pool, nsamples // npool),
+                                               nsamples % npool)
+        return pool
+
+    def draw_dur(self, rng: np.random.Generator | None = None) -> np.ndarray:
+        """
+        random part of parse_dur: fill pool to dur_nsamples and shuffle.
+        run once per iteration after fit_dur. next_dur() reads from the result
+        @param rng  default seeded from random, so random.seed() still repeats draws
+        """
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+        dur = self.dur_base
+        if self.dur_extra:
+            extra = rng.choice(self.dur_pool, self.dur_extra, replace=False)
+            dur = np.concatenate((dur, extra))
+        dur = rng.permutation(dur)
 
         if self.verbose > 1:
             print("shuffling %s (%d/%d): %s" %
-                  (self.name, len(dur), nsamples, dur))
+                  (self.name, len(dur), self.dur_nsamples, dur))
             print_uniq_c(dur)
 
-        random.shuffle(dur)
-        dur = dur[0:nsamples]
         self.dur_dist = dur
-        # self.dur_dist_avg = functools.reduce(lambda x, y: x+y, dur)/len(dur)
+        self.dur_cursor = 0
         if len(dur) == 0:
             print(f"WARNING: event {self.name} is never included (no durations)!")
             self.dur_dist_avg = 0
             return dur
 
-        self.dur_dist_avg = sum(dur)/len(dur)
+        self.dur_dist_avg = dur.mean()
         return dur
 
     def next_dur(self):
-        if len(self.dur_dist) == 0:
+        if self.dur_cursor >= len(self.dur_dist):
             print("WARNING: %s: no more durations to pick from. giving 0" %
                   self.name)
             return(0)
         else:
-            dur = self.dur_dist.pop()
+            dur = float(self.dur_dist[self.dur_cursor])
+            self.dur_cursor += 1
             if self.verbose > 10:
-                print('%s: %s --> %.01f' % (self.name, self.dur_dist, dur))
-            #if not self.picked: self.picked=0
-            #self.picked+=1
+                print('%s: %d left --> %.01f' %
+                      (self.name, len(self.dur_dist) - self.dur_cursor, dur))
             return(dur)
 
 def uniquenode(n):
@@ -0,0 +1,70 @@
+"""
+FittedDesign is an event tree (LastLeaves) fit to run settings once.
+
+Fitting (rep counts, master node refs, duration pools, branch templates)
+only depends on the tree and settings. Iterations only need to redraw
+durations and shuffle trials, see FittedDesign.draw.
+"""
+import random
+import sys
+import numpy as np
+from .LastLeaves import LastLeaves
+from .TrialList import add_itis, shuffle_triallist
+from .TrialArray import TrialArray
+from .instrument import stage
+
+
+class FittedDesign:
+    """
+    LastLeaves with fit_tree already applied for settings['ntrial'].
+    Build once, then draw() a new (shuffled) trial list each iteration.
+    """
+
+    def __init__(self, last_leaves: LastLeaves, settings: dict, verb=1):
+        self.last_leaves = last_leaves
+        self.settings = settings
+        self.verb = verb
+        # updates the nodes of tree: need_total, total_reps, master refs, dur pools
+        # nothing is drawn until draw() gives a seeded generator
+        with stage("fit_tree"):
+            (self.n_rep_branches, self.nperms) = last_leaves.fit_tree(settings["ntrial"],
+                                                                      draw=False)
+        self.unique_nodes = last_leaves.unique_nodes
+        # branches as integer arrays. per iteration only durations change
+        self.template = last_leaves.compile_templates(
+            self.n_rep_branches, settings["miniti"], settings["granularity"])
+
+        if verb > 0:
+            print(
+                "single run: %d reps of (%d final branches, seen a total of %d times)"
+                % (self.n_rep_branches, len(last_leaves), self.nperms)
+            )
+
+    def triallist(self, rng: np.random.Generator | None = None) -> TrialArray:
+        """
+        redraw durations and make an (unshuffled) trial list with itis
+        like LastLeaves.to_triallist without refitting the tree.
+        .to_triallist() for the list of event dicts
+        @param rng  default seeded from random, like EventNode.draw_dur
+        """
+        with stage("draw_dur"):
+            if rng is None:
+                rng = np.random.default_rng(random.getrandbits(64))
+            for u in self.unique_nodes:
+                u.draw_dur(rng)
+        with stage("triallist"):
+            triallist = self.template.fill()
+            return add_itis(triallist, self.settings, self.verb)
+
+    def draw(self, seed=None) -> tuple[TrialArray | None, int]:
+        """
+        durations and trial order for one iteration. reproducible with seed
+        @return (shuffled triallist or None if no shuffle fit, seed)
+        """
+        if seed is None:
+            seed = random.randrange(sys.maxsize)
+        # durations from a numpy generator, trial order from random. both from seed
+        triallist = self.triallist(np.random.default_rng(seed))
+        myrand = random.Random(seed)
+        with stage("shuffle"):
+            return shuffle_triallist(self.settings, triallist, seed, myrand=myrand)
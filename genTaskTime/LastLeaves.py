@@ -1,10 +1,12 @@
 import anytree
-import copy
 import pprint
 import re
 from .EventNode import EventNode, create_master_refs
 from .EventGrammar import unlist_grammar
 from .TrialList import add_itis, TrialList
+from .TrialArray import TrialArray, TrialTemplate, ITI_CODE
+import numpy as np
+from .instrument import stage
 
 
 def rand_round(val, myrand=None):
@@ -12,6 +14,44 @@ def rand_round(val, myrand=None):
     return int(val + rand)
 
 
+def is_catch(node) -> bool:
+    """
+    __catch__ trials are special
+    timing should go into preceding child
+    identified by name. TODO: catch property (or function) to node?
+    """
+    return re.match(r"__catch__[0-9]+", node.name) is not None
+
+
+def branch_events(leaf) -> list[tuple[list[str], list]]:
+    """
+    group the nodes on a leaf's branch into the events of a trial.
+    a node with a duration starts a new event. nodes without (sub events)
+    add their name (e.g. cue_A) and duration to the event before them.
+    catch nodes add only duration.
+    uses master nodes if tree is fit (see create_master_refs)
+
+    @param leaf  last leaf node
+    @return list of (fname list, nodes to draw durations from)
+    """
+    events = []
+    fname = []
+    nodes = []
+    for n in getattr(leaf, "parents", leaf.path):
+        n = getattr(n, "master_node", n)
+        if n.dur != 0:
+            if fname:
+                events.append((fname, nodes))
+            fname = []
+            nodes = []
+        if not is_catch(n):
+            fname.append(n.name)
+        nodes.append(n)
+    if fname:
+        events.append((fname, nodes))
+    return events
+
+
 class LastLeaves(list):
     """
     List containing pointers to EventNode elements.
@@ -64,8 +104,6 @@ class LastLeaves(list):
 
         triallist = []
         for l in self:
-            branch_nodes = l.parents
-
             n_total_branch_reps = n_rep_branches * l.need_total
             # l.need_total == l.count_branch_reps()
 
@@ -86,27 +124,13 @@ class LastLeaves(list):
             if l.root.verbose > 1:
                 print(msg)
 
+            events = branch_events(l)
             for branch_rep_i in range(round(n_total_branch_reps)):
                 thistrial = []
-                fname = []
-                dur = 0
-                for n in branch_nodes:
-                    n = n.master_node
-                    if n.dur != 0:
-                        if fname:
-                            thistrial.append(
-                                {"fname": fname, "dur": dur, "type": "event"}
-                            )
-                        fname = []
-                        dur = 0
-
-                    # __catch__ trials are special
-                    # timing should go into preceding child
-                    # identified by name. TODO: catch property (or function) to node?
-                    if not re.match(r"__catch__[0-9]+", n.name):
-                        fname.append(n.name)
-                    dur += n.next_dur()
-                if fname:
+                for fname, nodes in events:
+                    dur = 0
+                    for n in nodes:
+                        dur += n.next_dur()
                     thistrial.append({"fname": fname, "dur": dur, "type": "event"})
                 if min_iti is not None and min_iti > 0:
                     thistrial.append({"fname": None, "dur": min_iti, "type": "iti"})
@@ -119,10 +143,73 @@ class LastLeaves(list):
             pprint.pprint(triallist)
         return triallist
 
-    def fit_tree(self, ntrials: int, myrand=None) -> tuple[int, int]:
+    def compile_templates(self, n_rep_branches, min_iti, granularity) -> TrialTemplate:
+        """
+        each leaf's branch as a fixed list of events (branch_events) repeated
+        n_rep_branches * need_total times, as integer arrays. no durations yet:
+        TrialTemplate.fill() draws them each iteration without walking the tree
+        """
+        fnames: list[list[str]] = []
+        codes: dict[tuple, int] = {}
+        nodes: list = []
+        node_idx: dict[int, int] = {}
+        add_iti = min_iti is not None and min_iti > 0
+        (row_code, row_base, slot_row, slot_node, lens) = ([], [], [], [], [])
+        nrow = 0
+        for l in self:
+            # one trial of this branch
+            t_code = []
+            t_slot_row = []
+            t_slot_node = []
+            for fname, event_nodes in branch_events(l):
+                key = tuple(fname)
+                if key not in codes:
+                    codes[key] = len(fnames)
+                    fnames.append(fname)
+                for n in event_nodes:
+                    if id(n) not in node_idx:
+                        node_idx[id(n)] = len(nodes)
+                        nodes.append(n)
+                    t_slot_row.append(len(t_code))
+                    t_slot_node.append(node_idx[id(n)])
+                t_code.append(codes[key])
+            t_base = [0.0] * len(t_code)
+            if add_iti:
+                t_code.append(ITI_CODE)
+                t_base.append(min_iti)
+
+            # repeated
+            nreps = round(n_rep_branches * l.need_total)
+            ntrial_rows = len(t_code)
+            row_code.append(np.tile(t_code, nreps))
+            row_base.append(np.tile(t_base, nreps))
+            rep_start = nrow + ntrial_rows * np.arange(nreps)
+            slot_row.append((rep_start[:, np.newaxis] + t_slot_row).ravel())
+            slot_node.append(np.tile(t_slot_node, nreps))
+            lens.append(np.full(nreps, ntrial_rows))
+            nrow += ntrial_rows * nreps
+
+        def cat(arrays, dtype):
+            return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+
+        offsets = np.concatenate(([0], np.cumsum(cat(lens, np.int64))))
+        return TrialTemplate(cat(row_code, np.int32), cat(row_base, float), offsets,
+                             cat(slot_row, np.int64), cat(slot_node, np.int64),
+                             nodes, fnames, granularity)
+
+    def event_tree_to_array(self, n_rep_branches, min_iti, granularity) -> TrialArray:
+        """
+        event_tree_to_list as a TrialArray. same trials in the same order
+        and durations drawn the same way (next_dur order), but no dict per event
+        """
+        return self.compile_templates(n_rep_branches, min_iti, granularity).fill()
+
+    def fit_tree(self, ntrials: int, myrand=None, draw=True) -> tuple[int, int]:
         """
         @param ntrials     total trials to fit into run
         @param myran       random seed, see MYRAND
+        @param draw        also draw durations (from random, see EventNode.draw_dur)
+                           so event_tree_to_list can run. FittedDesign draws its own
         @returns           tuple (n_rep_branches, nperms)
           nperms         - total count need to represent all branches
                            normalized to nreps; accounts for uneven repeats
@@ -135,7 +222,7 @@ class LastLeaves(list):
         runs side effect functions to update node properties:
           * updates node.need_total (set_last)
           * update tree for the number of trials we have (count_reps)
-          * duration distribution (parse_dur)
+          * duration distribution (fit_dur, and draw_dur if draw)
         """
         # how many times do we go down the tree?
         nperms = 0
@@ -177,10 +264,15 @@ class LastLeaves(list):
         # different branches have nodes with the same name
         # link them all to one node so we can draw duration times from that one
         unique_nodes = create_master_refs(root)
+        self.unique_nodes = unique_nodes
 
         # set up delay distributions
-        for u in unique_nodes:
-            u.parse_dur(n_rep_branches)
+        with stage("parse_dur"):
+            for u in unique_nodes:
+                if draw:
+                    u.parse_dur(n_rep_branches)
+                else:
+                    u.fit_dur(n_rep_branches)
 
         return (n_rep_branches, nperms)
 
@@ -288,7 +380,9 @@ def mkChild(parents, elist, verb=1):
     @param parents  list of EventNotes (or single root node)
     @param elist    list of events (likely from parse_events/unlist_grammar)
 
-    Recursive function to populate leaves of tree
+    Populate leaves of tree: each factor ('*' separated) in elist is crossed
+    with the children of the one before it. elist (the cached AST) is only read
+    @return last children (leaves)
     """
 
     # make sure we're starting with a list
@@ -297,70 +391,32 @@ def mkChild(parents, elist, verb=1):
         print("mkChild: parent type=%s, expected list: %s" % (type(parents), parents))
         parents = [parents]
 
-    # children will be added to parents
-    children = parents
-
-    # tmp copy because we're poping off it
-    # and we need a list even if it's only one item
-    subevent_list = unlist_grammar(copy.deepcopy(elist))
-    if type(subevent_list) not in [list, tuple]:
-        subevent_list = [subevent_list]
-
-    # no more children to process
-    # end recursive calls
-    if len(subevent_list) == 0:
-        return children
-
-    children = []
-    if verb > 1:
-        print("popping from: %s" % subevent_list)
-    seitem = subevent_list.pop(0)
-
-    # skip '*'
-    if type(seitem) is str:
-        print(f"mkChild: skipping str '{seitem}' (expect '*')")
-        seitem = subevent_list.pop(0)
-
-    if verb > 1:
-        print("mkChild on %s" % seitem)
-
-    # if we only have 1 subevent, still need to treat it like a list
-    if type(seitem["subevent"]) not in [list, tuple]:
+    # '*' and ',' are dropped by unlist_grammar. one item per factor
+    for seitem in unlist_grammar(elist):
         if verb > 1:
-            print(f"mkChild: item type={type(seitem['subevent'])} not list/tuple")
-            print("coercing: %s" % str(seitem["subevent"]))
-        seitem["subevent"] = [seitem["subevent"]]
-
-    these_subevets = unlist_grammar(seitem["subevent"])
-
-    for sube_info in these_subevets:
-        if type(sube_info) is str:
-            if verb > 1:
-                print(f"\tskipping {sube_info} (expect == ')")
-            continue  # skip ','
+            print("mkChild on %s" % seitem)
 
-        if verb > 1:
-            print("\tsube_info: %s" % sube_info)
+        # if we only have 1 subevent, still need to treat it like a list
+        subevents = seitem["subevent"]
+        if type(subevents) not in [list, tuple]:
+            subevents = [subevents]
 
-        name = sube_info["subname"]
-        freq = sube_info["freq"]
-        if freq:
-            freq = int(freq)
-        for p in parents:
+        children = []
+        for sube_info in unlist_grammar(subevents):
             if verb > 1:
-                print("\t\tadding child %s to parent %s" % (name, p))
-
-            children.append(EventNode(name, parent=p, nrep=freq, dur=0, verbose=verb))
+                print("\tsube_info: %s" % sube_info)
 
-    # continue down the line
-    # TODO: fix bad hack; break out of list
-    if len(subevent_list) == 1 and str(subevent_list[0] == list):
-        print("\tTODO: do not break recursive list")
-        subevent_list = subevent_list[0]
+            name = sube_info["subname"]
+            freq = sube_info["freq"]
+            if freq:
+                freq = int(freq)
+            for p in parents:
+                if verb > 1:
+                    print("\t\tadding child %s to parent %s" % (name, p))
 
-    if verb > 1:
-        print("\t\trecurse DOWN: %s" % subevent_list)
+                children.append(EventNode(name, parent=p, nrep=freq, dur=0, verbose=verb))
 
-    children = mkChild(children, subevent_list, verb)
+        # next factor crosses with these
+        parents = children
 
-    return children
+    return parents
@@ -0,0 +1,228 @@
+"""
+TrialArray is a TrialList (list of trials, each a list of event dicts)
+as flat arrays: one structured array of every event and the offset where
+each trial starts.
+
+  events   code  dur   is_iti     code indexes fnames/names. -1 for itis
+           0     1.5   False      cue_A
+           2     1.0   False      end
+           -1    1.0   True       miniti ending the trial
+           ...
+  offsets  [0, 3, ...]            trial i is events[offsets[i]:offsets[i+1]]
+
+Like TrialList, a trial whose first event is an iti is an iti 'trial'
+(the pooled remaining time or a gap between trials, see TrialList.add_itis).
+Shuffling reorders trials (take) and puts gaps between them (interleave).
+to_triallist/from_triallist convert to and from the list of dicts.
+
+TrialTemplate is a fit tree's trials as integer arrays (event codes, which
+nodes' draws make each duration). fill() makes a TrialArray per iteration.
+"""
+import numpy as np
+
+EVENT_DTYPE = np.dtype([("code", "<i4"), ("dur", "<f8"), ("is_iti", "?")])
+ITI_CODE = -1
+
+
+class TrialArray:
+    """
+    @param events       structured array (EVENT_DTYPE), row per event
+    @param offsets      start of each trial in events, plus len(events) at the end
+    @param fnames       fname list for each code like ['cue', 'A']
+    @param granularity  iti slot size (settings['granularity'])
+    """
+
+    __slots__ = ("events", "offsets", "fnames", "granularity")
+
+    def __init__(self, events: np.ndarray, offsets: np.ndarray, fnames: list[list[str]],
+                 granularity: float):
+        self.events = events
+        self.offsets = offsets
+        self.fnames = fnames
+        self.granularity = granularity
+
+    @classmethod
+    def from_triallist(cls, triallist: list[list[dict]], granularity: float,
+                       fnames: list[list[str]] | None = None) -> "TrialArray":
+        """
+        @param fnames  known codes (extended with any new fname)
+        """
+        fnames = list(fnames or [])
+        codes = {tuple(f): i for i, f in enumerate(fnames)}
+        rows = []
+        for t in triallist:
+            for e in t:
+                if e["type"] == "iti" or not e["fname"]:
+                    rows.append((ITI_CODE, e["dur"], True))
+                    continue
+                key = tuple(e["fname"])
+                if key not in codes:
+                    codes[key] = len(fnames)
+                    fnames.append(list(e["fname"]))
+                rows.append((codes[key], e["dur"], False))
+        offsets = np.cumsum([0] + [len(t) for t in triallist], dtype=np.int64)
+        return cls(np.array(rows, dtype=EVENT_DTYPE), offsets, fnames, granularity)
+
+    def to_triallist(self) -> list[list[dict]]:
+        "list of event dicts like LastLeaves.to_triallist (fname lists are shared)"
+        triallist = []
+        for (start, end) in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            trial = []
+            for (code, dur, is_iti) in self.events[start:end].tolist():
+                if is_iti:
+                    trial.append({"fname": None, "dur": dur, "type": "iti"})
+                else:
+                    trial.append({"fname": self.fnames[code], "dur": dur, "type": "event"})
+            if trial[0]["type"] == "iti":
+                trial[0]["nslots"] = self.slots(trial[0]["dur"])
+            triallist.append(trial)
+        return triallist
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def names(self) -> np.ndarray:
+        "output name per code ('cue_A'). last entry is for ITI_CODE (-1)"
+        return np.array(["_".join(f) for f in self.fnames] + ["__iti__"], dtype=object)
+
+    def slots(self, dur) -> int:
+        return int(round(dur / self.granularity))
+
+    def iti_trials(self) -> np.ndarray:
+        "mask of trials that are only iti (pooled or gap)"
+        return self.events["is_iti"][self.offsets[:-1]]
+
+    def split_itis(self) -> tuple["TrialArray", int]:
+        """
+        @return (only trials with events, total iti slots in the iti trials)
+        """
+        is_iti = self.iti_trials()
+        nslots = sum(self.slots(d) for d in self.events["dur"][self.offsets[:-1][is_iti]])
+        return (self.take(np.flatnonzero(~is_iti)), nslots)
+
+    def take(self, order) -> "TrialArray":
+        "trials in order (like [trials[i] for i in order])"
+        order = np.asarray(order, dtype=np.int64)
+        lens = np.diff(self.offsets)[order]
+        new_offsets = np.concatenate(([0], np.cumsum(lens)))
+        # index of every event: each trial's start then counting up
+        idx = (np.repeat(self.offsets[order] - new_offsets[:-1], lens)
+               + np.arange(new_offsets[-1]))
+        return TrialArray(self.events[idx], new_offsets, self.fnames, self.granularity)
+
+    def interleave(self, gaps) -> "TrialArray":
+        """
+        put an iti trial of gaps[0] slots before the first trial and of gaps[i]
+        after trial i. gaps of 0 are left out
+        """
+        gaps = np.asarray(gaps, dtype=np.int64)
+        lens = np.diff(self.offsets)
+        # trial lengths in output order: [gap0, trial0, gap1, trial1, gap2, ...]
+        out_lens = np.zeros(2 * len(lens) + 1, dtype=np.int64)
+        out_lens[0::2] = gaps > 0
+        out_lens[1::2] = lens
+        # iti rows go before the event at these positions (end of the trial before)
+        pos = self.offsets[np.flatnonzero(gaps > 0)]
+        itis = np.zeros(len(pos), dtype=EVENT_DTYPE)
+        itis["code"] = ITI_CODE
+        itis["dur"] = gaps[gaps > 0] * self.granularity
+        itis["is_iti"] = True
+        events = np.insert(self.events, pos, itis)
+        offsets = np.concatenate(([0], np.cumsum(out_lens[out_lens > 0])))
+        return TrialArray(events, offsets, self.fnames, self.granularity)
+
+    def append_iti(self, nslots: int) -> "TrialArray":
+        "add an iti trial of nslots (the pooled remaining time)"
+        iti = np.array([(ITI_CODE, nslots * self.granularity, True)], dtype=EVENT_DTYPE)
+        return TrialArray(np.concatenate((self.events, iti)),
+                          np.append(self.offsets, self.offsets[-1] + 1),
+                          self.fnames, self.granularity)
+
+    def trial_durs(self) -> np.ndarray:
+        "total duration of each trial"
+        if len(self) == 0:
+            return np.zeros(0)
+        return np.add.reduceat(self.events["dur"], self.offsets[:-1])
+
+    def to_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        "like TrialList.triallist_to_arrays: (event names, durations, iti mask)"
+        return (self.names[self.events["code"]],
+                self.events["dur"].astype(float),
+                self.events["is_iti"].copy())
+
+    def iti_list(self) -> list[float]:
+        "like TrialList.iti_list: summed durations of each run of iti events"
+        is_iti = self.events["is_iti"]
+        if not is_iti.any():
+            return []
+        # start of a run of itis, id per run
+        starts = is_iti & ~np.concatenate(([False], is_iti[:-1]))
+        run = np.cumsum(starts) - 1
+        return np.bincount(run[is_iti], weights=self.events["dur"][is_iti]).tolist()
+
+
+class TrialTemplate:
+    """
+    unshuffled trials of a fit tree with the durations left blank
+    (LastLeaves.compile_templates). fill() puts in durations drawn
+    for this iteration without walking the tree.
+
+    Every event's duration is the sum of one draw from each of its nodes
+    (nodes without a duration of their own, catch nodes).
+    'slots' are those draws, in the order event_tree_to_list would next_dur() them
+
+    @param codes       code per event row (ITI_CODE for miniti)
+    @param base_dur    fixed duration per row (miniti, 0 for events)
+    @param offsets     trial starts in rows (+ end)
+    @param slot_row    row each slot adds to
+    @param slot_node   index into nodes of each slot
+    @param nodes       (master) nodes with dur_dist to draw from
+    """
+
+    __slots__ = ("codes", "base_dur", "offsets", "slot_row", "slot_node", "slot_rank",
+                 "node_need", "nodes", "fnames", "granularity")
+
+    def __init__(self, codes: np.ndarray, base_dur: np.ndarray, offsets: np.ndarray,
+                 slot_row: np.ndarray, slot_node: np.ndarray, nodes: list,
+                 fnames: list[list[str]], granularity: float):
+        self.codes = codes
+        self.base_dur = base_dur
+        self.offsets = offsets
+        self.slot_row = slot_row
+        self.slot_node = slot_node
+        self.nodes = nodes
+        self.fnames = fnames
+        self.granularity = granularity
+        # nth draw from its node. stable sort keeps slot order within a node
+        order = np.argsort(slot_node, kind="stable")
+        self.node_need = np.bincount(slot_node, minlength=len(nodes))
+        starts = np.concatenate(([0], np.cumsum(self.node_need)[:-1]))
+        self.slot_rank = np.empty(len(slot_node), dtype=np.int64)
+        self.slot_rank[order] = np.arange(len(slot_node)) - np.repeat(starts, self.node_need)
+
+    def fill(self) -> TrialArray:
+        """
+        trials with durations from each node's dur_dist (see EventNode.draw_dur).
+        draws are taken like next_dur(): from dur_cursor on, which is moved past them
+        """
+        # unused draws, then a 0 for draws past the end of a pool
+        pools = [np.asarray(n.dur_dist[n.dur_cursor:], dtype=float) for n in self.nodes]
+        have = np.array([len(p) for p in pools], dtype=np.int64)
+        flat = np.concatenate(pools + [np.zeros(1)])
+        starts = np.concatenate(([0], np.cumsum(have)[:-1]))
+        ok = self.slot_rank < have[self.slot_node]
+        slot_dur = flat[np.where(ok, starts[self.slot_node] + self.slot_rank, len(flat) - 1)]
+
+        for (n, need, n_have) in zip(self.nodes, self.node_need.tolist(), have.tolist()):
+            if need > n_have:
+                print("WARNING: %s: no more durations to pick from. giving 0 (%d times)" %
+                      (n.name, need - n_have))
+            n.dur_cursor += min(need, n_have)
+
+        events = np.empty(len(self.codes), dtype=EVENT_DTYPE)
+        events["code"] = self.codes
+        events["dur"] = self.base_dur + np.bincount(self.slot_row, weights=slot_dur,
+                                                    minlength=len(self.codes))
+        events["is_iti"] = self.codes == ITI_CODE
+        return TrialArray(events, self.offsets, self.fnames, self.granularity)
@@ -6,51 +6,105 @@ A trials is a list of event dictionaries.
 
 
 To fill time, inter trial intervals (trials with event types=='iti') are shuffled in.
+Unshuffled, all the remaining time is one pooled iti trial counted in
+'nslots' of settings['granularity'] (see add_itis)
  [ [{'fname': 'A', 'onset': 0, 'dur': 1.5, 'type': 'event'}, ...],
-   [{'type': 'iti', dur=0.1]],
-   [{'type': 'iti', dur=0.1]],
+   ...
+   [{'type': 'iti', dur=12.3, nslots=123}]]
+
+Shuffling draws a trial order and a gap vector: how many slots go
+before the first trial and after each trial (see gap_vector).
+Only gaps > 0 are put between trials:
+ [ [{'type': 'iti', dur=0.2, nslots=2}],
+   [{'fname': 'A', 'onset': 0, 'dur': 1.5, 'type': 'event'}, ...],
+   [{'type': 'iti', dur=0.1, nslots=1}],
    ...]
 
+FittedDesign builds the same thing as a TrialArray (flat numpy arrays).
+Functions here take either. TrialArray.to_triallist gives the list of dicts.
+
+pandas is only imported by the functions that make or write dataframes.
 """
+from __future__ import annotations
 
-import pandas as pd
 import numpy as np
+import functools
+import math
 import pprint
 import random
 import sys
 import os
-import copy
+from typing import TYPE_CHECKING
 from .badmath import print_uniq_c
+from .instrument import PROFILE, stage, count
+from .TrialArray import TrialArray
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 MYRAND = random.Random(random.randrange(sys.maxsize))
 TrialList = list[list[dict]]
+Trials = TrialList | TrialArray
 
 
-def triallist_to_df(triallist: TrialList, start_at_time: float) -> pd.DataFrame:
+def triallist_to_arrays(triallist: Trials) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    flatten trials into per event arrays
+    @param triallist  list of event lists: LastLeaves.to_triallist + add_itis()
+                      or TrialArray
+    @return (event names, durations, iti mask)
+            fname lists like ['cue','left'] are joined like 'cue_left'. itis are '__iti__'
+    """
+    if isinstance(triallist, TrialArray):
+        return triallist.to_arrays()
+    events = [t for tt in triallist for t in tt]
+    is_iti = np.array([not t["fname"] for t in events], dtype=bool)
+    names = np.array(["_".join(t["fname"]) if t["fname"] else "__iti__"
+                      for t in events], dtype=object)
+    durs = np.array([t["dur"] for t in events], dtype=float)
+    return (names, durs, is_iti)
+
+
+def event_rows(names: np.ndarray, durs: np.ndarray, is_iti: np.ndarray,
+               start_at_time: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    onsets are the cumulative sum of durations.
+    consecutive itis are collapsed into one (summed) row
+    @return (event, onset, dur) arrays, one row per event
+    """
+    if len(durs) == 0:
+        return (np.zeros(0, dtype=object), np.zeros(0), np.zeros(0))
+    onsets = np.cumsum(np.concatenate(([start_at_time], durs[:-1])))
+    # new row unless iti following an iti. run_id groups itis with the row they join
+    keep = np.ones(len(durs), dtype=bool)
+    keep[1:] = ~(is_iti[1:] & is_iti[:-1])
+    run_id = np.cumsum(keep) - 1
+    return (names[keep], onsets[keep], np.bincount(run_id, weights=durs))
+
+
+def events_to_df(names: np.ndarray, durs: np.ndarray, is_iti: np.ndarray,
+                 start_at_time: float) -> pd.DataFrame:
+    """
+    event_rows as a dataframe
+    @return dataframe row per event. columns: event, onset, dur
+    """
+    import pandas as pd
+    if len(durs) == 0:
+        return pd.DataFrame({"event": [], "onset": [], "dur": []})
+    (event, onset, dur) = event_rows(names, durs, is_iti, start_at_time)
+    return pd.DataFrame({"event": event, "onset": onset, "dur": dur})
+
+
+def triallist_to_df(triallist: Trials, start_at_time: float) -> pd.DataFrame:
     """
     @param triallist      list of event lists: LastLeaves.to_triallist + add_itis()
     @param start_at_time  initial onset time of first event
     @return dataframe row per event, including __iti__ time.
-            columns: fname, onset, dur
-    """
-    events = []
-    total_time = start_at_time
-    for tt in triallist:
-        for t in tt:
-            # fname is a list like ['cue','left'] or None for iti
-            # iti's are repeated based on iti resolution. collapse into one
-            name = "_".join(t["fname"]) if t["fname"] else "__iti__"
-            if (
-                name == "__iti__"
-                and len(events) > 0
-                and events[-1]["event"] == "__iti__"
-            ):
-                events[-1]["dur"] += t["dur"]
-            else:
-                events.append({"event": name, "onset": total_time, "dur": t["dur"]})
-            total_time += t["dur"]
-    return pd.DataFrame(events)
+            columns: event, onset, dur
+    """
+    (names, durs, is_iti) = triallist_to_arrays(triallist)
+    return events_to_df(names, durs, is_iti, start_at_time)
 
 
 def df_to_1D(
@@ -66,48 +120,70 @@ def df_to_1D(
     @param writedur included duration married to onset (like 'onset:dur')
     @return
     """
-    # initialize dict to hold output file handles.
-    # key   - output file handle
-    # value - list of "onset:duration" to write to file
-    write_to: dict[os.path, list[str]] = {}
+    # dont need 1D file for ITI
+    # maybe want to add 'no_1D' column to output of triallist_to_df
+    # instead of matching on name?
+    events = event_df[event_df["event"] != "__iti__"]
 
     # NB. 20240202 dataframe uses 3 decimal places (milliseconds)
     #              reducing to 2 for 1D files
-    for _, event in event_df.iterrows():
-        # dont need 1D file for ITI
-        # maybe want to add 'no_1D' column to output of triallist_to_df
-        # instead of matching on name?
-        if event["event"] == "__iti__":
-            continue
-
-        if writedur:
-            onsetstr = "%.02f:%.02f" % (event["onset"], event["dur"])
-        else:
-            onsetstr = "%.02f" % event["onset"]
-
-        outname = os.path.join(savedir if savedir else "", event["event"] + ".1D")
-        if not write_to.get(outname):
-            write_to[outname] = []
-        write_to[outname].append(onsetstr)
+    # format every onset (and duration) at once
+    onsetstr = np.char.mod("%.02f", events["onset"].to_numpy(dtype=float))
+    if writedur:
+        durstr = np.char.mod("%.02f", events["dur"].to_numpy(dtype=float))
+        onsetstr = np.char.add(np.char.add(onsetstr, ":"), durstr)
+
+    # group by event, in order of first appearance. stable sort keeps onset order
+    import pandas as pd
+    (codes, names) = pd.factorize(events["event"])
+    order = np.argsort(codes, kind="stable")
+    groups = np.split(onsetstr[order], np.cumsum(np.bincount(codes, minlength=len(names)))[:-1])
+
+    # key   - output file name
+    # value - list of "onset:duration" to write to file
+    write_to: dict[os.path, list[str]] = {
+        os.path.join(savedir if savedir else "", name + ".1D"): onsets.tolist()
+        for name, onsets in zip(names, groups)
+    }
 
     # no savedir, no write
     if savedir is None:
         return write_to
 
+    # maybe event name has path separator? make each directory once
+    for outdir in set(os.path.dirname(f) for f in write_to):
+        os.makedirs(outdir, exist_ok=True)
+
     # finished building across all events.
-    # can now write onset collection to each file
+    # can now write onset collection to each file, in one write
     for out1D, onsets in write_to.items():
-        # maybe event name has path separator?
-        # if not, could just mkdirs(savedir) outside loop instead
-        os.makedirs(os.path.dirname(out1D), exist_ok=True)
-        fh_1D = open(out1D, "w")
-        fh_1D.write(" ".join(onsets) + "\n")
-        fh_1D.close()
+        line = " ".join(onsets) + "\n"
+        with open(out1D, "w") as fh_1D:
+            fh_1D.write(line)
+        count("bytes_written", len(line))
+        count("files_written")
 
     return write_to
 
 
-def add_itis(triallist: TrialList, settings: dict, verb=1) -> TrialList:
+def write_event_df(event_df: pd.DataFrame, savedir: os.PathLike) -> None:
+    """
+    one iteration's files: savedir/event_onset_duration.tsv and a 1D file per event
+    @param event_df dataframe with row per event. cols: event, onset, dur
+    """
+    os.makedirs(savedir, exist_ok=True)
+    tsv = os.path.join(savedir, "event_onset_duration.tsv")
+    with stage("write_tsv"):
+        event_df.to_csv(tsv, sep="\t", index=False, float_format="%.3f")
+    if PROFILE.enabled:
+        count("bytes_written", os.path.getsize(tsv))
+        count("files_written")
+    # write out 1D timing files. likely for AFNI's '3dDeconvolve -nodata'
+    with stage("write_1D"):
+        df_to_1D(event_df, savedir)
+
+
+def add_itis(triallist: Trials, settings: dict, verb=1) -> Trials:
     """
     fill remaining time with inter trial interval events
 
@@ -122,7 +198,10 @@ def add_itis(triallist: TrialList, settings: dict, verb=1) -> TrialList:
     # previously computed like
     # all_durs = [o['dur'] for x in triallist for o in x]
     # task_dur = functools.reduce(lambda x, y: x + y, all_durs)
-    each_event_dur = [sum([o["dur"] for o in x]) for x in triallist]
+    if isinstance(triallist, TrialArray):
+        each_event_dur = triallist.trial_durs().tolist()
+    else:
+        each_event_dur = [sum([o["dur"] for o in x]) for x in triallist]
     avgtaskdur = np.mean(each_event_dur)
     if verb > 1:
         print_uniq_c(each_event_dur)
@@ -143,7 +222,8 @@ def add_itis(triallist: TrialList, settings: dict, verb=1) -> TrialList:
         pprint.pprint(np.unique(sorted(each_event_dur)))
         if verb > 1:
             print("trial x event list:")
-            pprint.pprint(triallist)
+            pprint.pprint(triallist.to_triallist()
+                          if isinstance(triallist, TrialArray) else triallist)
         sys.exit(1)
 
         # TODO: maybe return None. exitings a bit extreme for a module!
@@ -163,75 +243,227 @@ def add_itis(triallist: TrialList, settings: dict, verb=1) -> TrialList:
         print(msg % (task_dur, rundur, settings["maxiti"], settings["ntrial"]))
         sys.exit(1)
 
-    # # calculate number of ITIs (in addition to miniti) we need.
-    # make them and add to triallist
+    # # calculate number of ITI slots (in addition to miniti) we need.
+    # pool them into a single iti trial. split up when shuffled
     n_iti = int((rundur - task_dur) / settings["granularity"])
-    triallist += [
-        [{"fname": None, "dur": settings["granularity"], "type": "iti"}]
-    ] * n_iti
+    if n_iti > 0 and isinstance(triallist, TrialArray):
+        triallist = triallist.append_iti(n_iti)
+    elif n_iti > 0:
+        triallist.append(iti_trial(n_iti, settings["granularity"]))
 
     return triallist
 
 
-def _shuffle_triallist(triallist: TrialList, myrand=MYRAND, noitifirst=False) -> None:
+def iti_trial(nslots: int, granularity: float) -> list[dict]:
+    """
+    iti 'trial' nslots*granularity long
+    """
+    return [{"fname": None, "dur": nslots * granularity, "type": "iti", "nslots": nslots}]
+
+
+def iti_slot_caps(settings: dict) -> tuple[int, int]:
+    """
+    most iti slots allowed before the first trial and after each trial
+    so no iti (including miniti already in each trial) is longer than maxiti
+    @return (maxfirst, maxslots)
+    """
+    granularity = settings["granularity"]
+    # tolerate float error like (2.5-1.5)/.5 == 1.9999
+    eps = 1e-6
+    maxslots = math.floor((settings["maxiti"] - settings["miniti"]) / granularity + eps)
+    maxfirst = math.floor(settings["maxiti"] / granularity + eps)
+    return (maxfirst, max(maxslots, 0))
+
+
+def _gap_tilt(target: float, cap: int) -> float:
+    """
+    log(theta) for a geometric distribution on 0..cap (P(v) ~ theta**v)
+    with mean near target. found by bisection
+    """
+    v = np.arange(cap + 1)
+    (lo, hi) = (-20.0, 20.0)
+    for _ in range(60):
+        q = (lo + hi) / 2
+        w = np.exp(q * v - max(q * cap, 0))
+        if (w * v).sum() / w.sum() < target:
+            lo = q
+        else:
+            hi = q
+    return (lo + hi) / 2
+
+
+def _trunc_conv(a: np.ndarray, b: np.ndarray, n: int) -> np.ndarray:
+    "a convolved with b (by fft), only the first n+1 values"
+    nfft = 1 << (len(a) + len(b) - 2).bit_length()
+    c = np.fft.irfft(np.fft.rfft(a, nfft) * np.fft.rfft(b, nfft), nfft)
+    c = c[: min(n, len(a) + len(b) - 2) + 1]
+    # fft noise
+    return np.clip(c, 0, None)
+
+
+@functools.lru_cache(maxsize=8)
+def _gap_sum_pmfs(nslots: int, ngaps: int, cap: int, q: float) -> dict[int, np.ndarray]:
+    """
+    pmf[m][t] is the probability m gaps sum to t slots when each gap is drawn
+    from a geometric distribution on 0..cap with log(theta) = q.
+    The number of ways t slots fit in m gaps is pmf[m][t] / theta**t up to a
+    constant, but the tilted pmf stays within float range where we sample.
+    Only the m visited when halving ngaps (see _split_gaps) are built: ~2*log2(ngaps)
+    cached for reuse across iterations
+    """
+    w = np.exp(q * np.arange(cap + 1) - max(q * cap, 0))
+    pmfs = {1: w / w.sum()}
+
+    def pmf(m):
+        if m not in pmfs:
+            pmfs[m] = _trunc_conv(pmf(m // 2), pmf(m - m // 2), nslots)
+        return pmfs[m]
+
+    pmf(ngaps)
+    return pmfs
+
+
+def _split_gaps(total: int, m: int, cap: int, pmfs: dict, myrand, gaps: list) -> None:
+    """
+    put total slots into m gaps (each <= cap). appends to gaps.
+    split in half: draw how many go to the first m//2 gaps
+    weighted by the ways each half can hold its share. then recurse
+    """
+    if m == 1:
+        gaps.append(total)
+        return
+    a = m // 2
+    b = m - a
+    x = np.arange(max(0, total - b * cap), min(total, a * cap) + 1)
+    weights = np.cumsum(pmfs[a][x] * pmfs[b][total - x])
+    if not weights[-1] > 0:
+        # underflow far from anything likely. everything in range is possible
+        weights = np.arange(1, len(x) + 1)
+    pick = int(np.searchsorted(weights, myrand.random() * weights[-1], side="right"))
+    pick = int(x[min(pick, len(x) - 1)])
+    _split_gaps(pick, a, cap, pmfs, myrand, gaps)
+    _split_gaps(total - pick, b, cap, pmfs, myrand, gaps)
+
+
+def _bounded_gap_vector(nslots, ntrials, myrand, maxfirst, maxslots) -> list[int] | None:
+    """
+    gap vector drawn uniformly from all with gap[0] <= maxfirst and
+    every other gap <= maxslots. one pass, no rejection:
+    gap[0] is drawn weighted by the ways the rest fit into ntrials gaps,
+    the rest are split in halves the same way (_split_gaps)
+    """
+    if nslots > maxfirst + ntrials * maxslots:
+        return None
+    if ntrials == 0 or maxslots == 0:
+        return [nslots] + [0] * ntrials
+
+    # center the tilted pmfs on where we expect to sample
+    # first gap gets its share of capacity
+    first_share = nslots * maxfirst / (maxfirst + ntrials * maxslots)
+    q = _gap_tilt((nslots - first_share) / ntrials, maxslots)
+    q = round(q, 6)  # stable cache key
+    pmfs = _gap_sum_pmfs(nslots, ntrials, maxslots, q)
+
+    # P(gap[0] == v) ~ ways nslots - v fit into ntrials gaps
+    v = np.arange(max(0, nslots - ntrials * maxslots), min(maxfirst, nslots) + 1)
+    with np.errstate(divide="ignore"):
+        logw = np.log(pmfs[ntrials][nslots - v]) + q * v
+    weights = np.cumsum(np.exp(logw - logw.max()))
+    pick = int(np.searchsorted(weights, myrand.random() * weights[-1], side="right"))
+    first = int(v[min(pick, len(v) - 1)])
+
+    gaps = [first]
+    _split_gaps(nslots - first, ntrials, maxslots, pmfs, myrand, gaps)
+    return gaps
+
+
+def gap_vector(
+    nslots: int, ntrials: int, myrand=MYRAND, noitifirst=False, maxslots=None, maxfirst=None
+) -> list[int] | None:
     """
-    shuffle the list, optionally ensuring outcome does not start with an ITI event type
-    works inplace on triallist
+    uniformly distribute nslots iti slots into ntrials+1 gaps
+    gap[0] is before the first trial, gap[i] is after trial i.
+    same distribution as shuffling nslots single slot itis in with the trials
+    and reshuffling until the max iti is satisfied. but without reshuffling.
+    @param noitifirst  gap[0] is always 0
+    @param maxslots    largest gap after a trial (None for no limit)
+    @param maxfirst    largest gap before the first trial (None for no limit)
+    @return gaps or None if nslots cannot fit within the limits
     """
-    myrand.shuffle(triallist)
-    # do we want an iti as first?
     if noitifirst:
-        cnt = 1
-        warnevery = 50
-        while triallist[0][0]["type"] == "iti":
-            myrand.shuffle(triallist)
-            if cnt % warnevery == 0:
-                mgs = (
-                    "WARNING: shuffle event list: %d iterations without "
-                    + "finiding a no-iti first version"
-                )
-                print(mgs % cnt)
+        maxfirst = 0
+    if maxfirst is None or maxfirst > nslots:
+        maxfirst = nslots
+    if maxslots is None or maxslots > nslots:
+        maxslots = nslots
+
+    # limits are tight. draw from only the gap vectors that satisfy them
+    if maxslots < nslots or 0 < maxfirst < nslots:
+        return _bounded_gap_vector(nslots, ntrials, myrand, maxfirst, maxslots)
+
+    # no limits: stars and bars -- pick where the bars go among nslots+ngaps-1
+    ngaps = ntrials + 1
+    first = 0
+    if maxfirst == 0:
+        ngaps -= 1
+        first = 1
+    if ngaps <= 0:
+        return [0] * (ntrials + 1)
+    bars = sorted(myrand.sample(range(nslots + ngaps - 1), ngaps - 1))
+    gaps = [0] * first
+    prev = -1
+    for b in bars:
+        gaps.append(b - prev - 1)
+        prev = b
+    gaps.append(nslots + ngaps - 1 - prev - 1)
+    return gaps
 
 
 def shuffle_triallist(
-    settings: dict, tl: TrialList, seed=None, maxiterations=5000
-) -> tuple[TrialList | None, int]:
+    settings: dict, tl: Trials, seed=None, maxiterations=5000, myrand=None
+) -> tuple[Trials | None, int]:
     """
-    shuffle trial list until the longest ITI is below the max from iti_list()
+    shuffle trial order and spread iti slots between trials
+    such that no iti (from iti_list) is longer than settings['maxiti']
+    @param tl      TrialArray, or list of trials (shuffled as a TrialArray)
+    @param maxiterations  unused. was the most reshuffles; gap_vector no longer reshuffles
+    @param myrand  continue an existing random stream (e.g. one that drew durations)
+                   instead of starting a new one from seed
+    @return (shuffled trials, same type as tl, or None if itis cannot fit maxiti, seed)
     """
-    triallist = copy.copy(tl)
+    granularity = settings["granularity"]
+    as_list = not isinstance(tl, TrialArray)
+    if as_list:
+        tl = TrialArray.from_triallist(tl, granularity)
+    (trials, nslots) = tl.split_itis()
     # set the seed
     if seed is None:
         seed = random.randrange(sys.maxsize)
-    myrand = random.Random(seed)
-
-    # initial shuffle, reproducable with given seed
-    noitifirst = settings["iti_never_first"]
-    _shuffle_triallist(triallist, myrand, noitifirst)
-
-    # reshuffle while too many itis in a row
-    inum = 1
-    warnevery = 50
-    while max(iti_list(triallist)) > settings["maxiti"]:
-        _shuffle_triallist(triallist, myrand, noitifirst)
-        inum += 1
-        if inum % warnevery == 0:
-            mgs = (
-                "WARNING: shuffle event list with seed %d has gone "
-                + "%d iterations without matching critera (maxiti: %f)"
-            )
-            print(mgs % (seed, warnevery, settings["maxiti"]))
-        if inum >= maxiterations:
-            print("ERROR: want %d interations and never found a match!" % maxiterations)
-            return (None, seed)
+    if myrand is None:
+        myrand = random.Random(seed)
+
+    # shuffle, reproducable with given seed
+    order = list(range(len(trials)))
+    myrand.shuffle(order)
+    (maxfirst, maxslots) = iti_slot_caps(settings)
+    # gap_vector samples exactly (no rejection): one attempt per iteration
+    count("shuffle_attempts")
+    gaps = gap_vector(nslots, len(trials), myrand,
+                      settings["iti_never_first"], maxslots, maxfirst)
+    if gaps is None:
+        count("shuffle_failed")
+        msg = "ERROR: %.2f of iti cannot be split between %d trials with maxiti %f!"
+        print(msg % (nslots * granularity, len(trials), settings["maxiti"]))
+        return (None, seed)
 
     # give back the shuffle and the seed used
-    return (triallist, seed)
+    shuffled = trials.take(order).interleave(gaps)
+    return (shuffled.to_triallist() if as_list else shuffled, seed)
 
 
-def iti_list(triallist: TrialList | None) -> list[float]:
+def iti_list(triallist: Trials | None) -> list[float]:
     """
-    @param triallist likely with many itis all with settings['granularity'] duration shuffled in. see add_itis(), _shuffle_triallist()
+    @param triallist itis (multiples of settings['granularity']) shuffled in. see add_itis(), _shuffle_triallist()
     returns list of collapsed (sum) iti durations between events
     """
     itis = []
@@ -239,6 +471,8 @@ def iti_list(triallist: TrialList | None) -> list[float]:
     if triallist is None:
         print("WARNING: generating iti list on empty trial list")
         return itis
+    if isinstance(triallist, TrialArray):
+        return triallist.iti_list()
 
     for x in triallist:
         # hit a real (non-iti) event, collect this iti
@@ -1,14 +1,130 @@
 #!/usr/bin/env python3
-from .EventGrammar import *
-from .EventNode import *
-from .generate import write_trials, parse_events, events_to_tree, verbose_info, str_to_last_leaves, str_to_triallist
-from .badmath import *
+"""
+Names are imported from the submodules on first use (PEP 562 __getattr__)
+so 'genTaskTime -h' and '-n' do not wait on pandas, numpy, or tatsu they never use.
+"""
+import importlib
 import os
 import sys
+import types
 import argparse
+from . import instrument
+
+# also in setup.py. part of the --cache-dir key
+__version__ = "0.1dev"
+
+# name -> submodule it comes from
+_EXPORTS = {
+    **{name: "generate" for name in (
+        "write_trials", "iter_designs", "Design", "iteration_seed", "parse_events",
+        "events_to_tree", "verbose_info", "str_to_last_leaves", "str_to_triallist")},
+    "EventNode": "EventNode",
+    "FittedDesign": "FittedDesign",
+    "EventStore": "store",
+    "export_store": "store",
+}
+# everything public in these is also exported (was 'from .X import *')
+_STAR_MODULES = ("EventGrammar", "EventNode", "badmath")
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    elif name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    else:
+        for modname in _STAR_MODULES:
+            module = importlib.import_module("." + modname, __name__)
+            if hasattr(module, name):
+                value = getattr(module, name)
+                break
+        else:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing submodule EventNode sets genTaskTime.EventNode to the module.
+        # keep that name for the class (like the star import did)
+        if isinstance(value, types.ModuleType) and name in ("EventNode", "FittedDesign"):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+
+def export_main(*args):
+    getargs = argparse.ArgumentParser(
+        prog="genTaskTime export",
+        description="Write iterations from a --store output back out as seed folders.")
+    getargs.add_argument('store', type=str, nargs=1,
+                         help="directory given to -o when running with --store")
+    getargs.add_argument('seeds', type=int, nargs='*',
+                         help="seeds to export (default: all)")
+    getargs.add_argument('-o', dest='outputdir', type=str, default=['.'], nargs=1,
+                         help="where to put seed folders (default='.')")
+    # seeds can come after -o
+    args = getargs.parse_intermixed_args(args)
+
+    from .store import EventStore, export_store
+    store = EventStore(args.store[0])
+    missing = set(args.seeds) - set(store.seeds.tolist())
+    if missing:
+        print("ERROR: seeds not in store '%s': %s" %
+              (args.store[0], " ".join(str(x) for x in sorted(missing))))
+        sys.exit(1)
+    export_store(args.store[0], args.seeds or None, args.outputdir[0])
+
+
+def merge_main(*args):
+    getargs = argparse.ArgumentParser(
+        prog="genTaskTime merge",
+        description="Combine --shard outputs into what one run with the same seed writes.")
+    getargs.add_argument('shards', type=str, nargs='+',
+                         help="output directory of each shard")
+    getargs.add_argument('-o', dest='outputdir', type=str, default=['stims'], nargs=1,
+                         help="where to put the merged result (default='stims/')")
+    args = getargs.parse_intermixed_args(args)
+
+    from .shard import merge_shards
+    try:
+        seeds = merge_shards(args.shards, args.outputdir[0])
+    except ValueError as err:
+        print("ERROR: %s" % err)
+        sys.exit(1)
+    print("merged %d shards: %d iterations in %s" %
+          (len(args.shards), len(seeds), args.outputdir[0]))
+
+
+def precheck(design, verb=1):
+    """
+    stop (in milliseconds, before any iteration) if design can never fill its run.
+    report at verb > 1 or when some draws will not fit
+    """
+    from .feasibility import check_feasible
+    with instrument.stage("precheck"):
+        feas = check_feasible(design)
+    if feas.errors or (verb > 0 and feas.warnings) or verb > 1:
+        print(feas.report())
+    if feas.errors:
+        sys.exit(1)
 
 
 def main(*args):
+    # subcommands. 'genTaskTime export ...', 'genTaskTime merge ...'
+    argv = list(args) if len(args) > 0 else sys.argv[1:]
+    if argv and argv[0] == "export":
+        return export_main(*argv[1:])
+    if argv and argv[0] == "merge":
+        return merge_main(*argv[1:])
+
     getargs = argparse.ArgumentParser(description="Make timing files by building an event tree from a DSL description of task timing.")
     getargs.add_argument('timing_description',
                          type=str, help='quoted string' +
@@ -23,6 +139,48 @@ def main(*args):
     getargs.add_argument('-n', '--dry', dest='show_only', action='store_const',
                          const=True, default=False,
                          help="Dry run. Show parsing of DSL only. Don't create files")
+    getargs.add_argument('-j', '--jobs', dest='jobs', type=int, default=[1],
+                         nargs=1,
+                         help="Number of processes to run iterations in (default=1)")
+    getargs.add_argument('--writers', dest='writers', type=int, default=[2], nargs=1,
+                         metavar='N',
+                         help="Threads writing files while the next iterations are made " +
+                         "(default=2). More help on slow (network) filesystems. 0 to write " +
+                         "in line. With -j, each process writes its own")
+    getargs.add_argument('--seed', dest='seed', type=int, default=[None],
+                         nargs=1,
+                         help="Base random seed. Same seed writes the same iterations")
+    getargs.add_argument('--keep-best', dest='keep_best', type=int, default=[None],
+                         nargs=1, metavar='K',
+                         help="Score every iteration (needs @TR in settings) but only " +
+                         "write the K best. All scores go to scores.tsv")
+    getargs.add_argument('--metric', dest='metric', type=str, default=['mean'],
+                         nargs=1,
+                         help="What --keep-best ranks by: 'mean' or 'min' efficiency " +
+                         "over all stims and glts, or the name of one (default=mean)")
+    getargs.add_argument('--store', dest='store', action='store_const',
+                         const=True, default=False,
+                         help="Append every iteration to one store (events.npy, index.npy, " +
+                         "names.txt) in the output directory instead of a folder per " +
+                         "iteration. See 'genTaskTime export -h'")
+    getargs.add_argument('--shard', dest='shard', type=str, default=None, metavar='i/N',
+                         help="Only run shard i (0 to N-1) of N's slice of the -i " +
+                         "iterations. Needs --seed. Put shards back together with " +
+                         "'genTaskTime merge'")
+    getargs.add_argument('--resume', dest='resume', action='store_const',
+                         const=True, default=False,
+                         help="Record finished iterations in manifest.tsv (output " +
+                         "directory). Rerunning with --resume skips them and carries on " +
+                         "with the same base seed")
+    getargs.add_argument('--cache-dir', dest='cache_dir', type=str, default=None,
+                         metavar='DIR',
+                         help="Keep the parsed and fit design in DIR, keyed by the " +
+                         "description and version. Later runs of the same description " +
+                         "load it instead of refitting")
+    getargs.add_argument('--profile', dest='profile', nargs='?', const='', default=None,
+                         metavar='JSON',
+                         help="Time each stage and count shuffles, failures, and bytes " +
+                         "written. Prints a table at the end. Also saves to JSON if given")
     getargs.add_argument('-v', dest='verbosity', default=[1],
                          nargs=1, type=int,
                          help="Verbosity. 0=print nothing. 99=everything. (default=1)")
@@ -33,11 +191,49 @@ def main(*args):
         args = getargs.parse_args()
 
     expstr = args.timing_description[0]
+    # not before parse_args: -h should not wait on imports
+    from .generate import verbose_info, str_to_last_leaves, write_trials
+    from .FittedDesign import FittedDesign
+    from .manifest import read_manifest
 
     if args.show_only or args.verbosity[0] > 1:
         verbose_info(expstr, args.verbosity[0])
 
-    if not args.show_only:
+    if args.show_only:
+        (last_leaves, settings) = str_to_last_leaves(expstr)
+        precheck(FittedDesign(last_leaves, settings, args.verbosity[0]), 99)
+    else:
+        if args.profile is not None:
+            instrument.enable()
+            # relative to where we started, not outdir
+            profile_json = os.path.abspath(args.profile) if args.profile else None
+        cache_dir = os.path.abspath(args.cache_dir) if args.cache_dir else None
+        shard = None
+        if args.shard:
+            from .shard import parse_shard
+            try:
+                shard = parse_shard(args.shard)
+            except ValueError as err:
+                print("ERROR: %s" % err)
+                sys.exit(1)
+            if args.seed[0] is None:
+                print("ERROR: --shard needs --seed: every shard must use the same base seed")
+                sys.exit(1)
+
+        # fit and check before making anything
+        #(triallist, settings) = str_to_triallist(expstr)
+        if cache_dir:
+            from .cache import cached_design
+            design = cached_design(expstr, cache_dir, args.verbosity[0])
+            (last_leaves, settings) = (design.last_leaves, design.settings)
+        else:
+            (last_leaves, settings) = str_to_last_leaves(expstr)
+            design = FittedDesign(last_leaves, settings, args.verbosity[0])
+        if args.keep_best[0] and not settings.get("tr"):
+            print("ERROR: --keep-best scores efficiency and needs a TR. like <300/40 @2>")
+            sys.exit(1)
+        precheck(design, args.verbosity[0])
+
         outdir = args.outputdir[0]
         # deal with where we are saving files
         if os.path.isfile(outdir):
@@ -48,10 +244,34 @@ def main(*args):
         os.chdir(outdir)
 
         # run
-        #(triallist, settings) = str_to_triallist(expstr)
-        (last_leaves, settings) = str_to_last_leaves(expstr)
-        write_trials(last_leaves, settings,
-                     args.n_iterations[0], args.verbosity[0])
+        manifest = None
+        if args.resume:
+            if args.keep_best[0] or args.store:
+                print("ERROR: --resume does not work with --keep-best or --store")
+                sys.exit(1)
+            manifest = "manifest.tsv"
+            try:
+                base_seed = read_manifest(manifest)[0]
+            except ValueError as err:
+                print("ERROR: %s" % err)
+                sys.exit(1)
+            if None not in (base_seed, args.seed[0]) and base_seed != args.seed[0]:
+                print("ERROR: %s/%s was made with --seed %d, not %d" %
+                      (outdir, manifest, base_seed, args.seed[0]))
+                sys.exit(1)
+        with instrument.stage("write_trials"):
+            write_trials(last_leaves, settings,
+                         args.n_iterations[0], args.verbosity[0],
+                         seed=args.seed[0], jobs=args.jobs[0],
+                         keep_best=args.keep_best[0], metric=args.metric[0],
+                         store="." if args.store else None, design=design,
+                         manifest=manifest, shard=shard, writers=args.writers[0])
+
+        if args.profile is not None:
+            print(instrument.PROFILE.summary())
+            if profile_json:
+                instrument.PROFILE.write_json(profile_json)
+            instrument.enable(False)
 
 
 if __name__ == '__main__':
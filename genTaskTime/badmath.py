@@ -16,6 +16,21 @@ def mod_no_zero(a, b, zero=None):
     return(r)
 
 
+def round_robin(freq, n, start, step):
+    """
+    add step to freq[start], freq[start+1], ... (wrapping around) n times.
+    closed form: everyone gets n//len, the first n%len from start one more
+    @return next start
+    """
+    nelm = len(freq)
+    (full, extra) = divmod(n, nelm)
+    for k in range(nelm):
+        freq[k] += step * full
+    for k in range(extra):
+        freq[(start + k) % nelm] += step
+    return (start + n) % nelm
+
+
 def fit_dist(nelm, freq, nsamples):
     """
     adjust freq list such that
@@ -23,6 +38,7 @@ def fit_dist(nelm, freq, nsamples):
       len(freq) == nelm
     does not do a good job preserving geometic distribution
     """
+    freq = list(freq)
     nsamples_in_freq = sum(freq)
     if nelm > nsamples_in_freq:
         print("WARNING: fitting distribution wih more elements than sum of" +
@@ -62,23 +78,25 @@ def fit_dist(nelm, freq, nsamples):
     # if we want nsamples but freq doesn't sum to that number
     # we need to do some fiddling
 
-    # if we have too many frequences, bump them
+    # if we have too many frequences, take one from each in turn.
+    # while the total is still above len(freq), nothing is skipped: round robin
     i = 0
+    if nsamples_in_freq > nsamples:
+        n_plain = min(nsamples_in_freq - nsamples,
+                      max(nsamples_in_freq - len(freq), 0))
+        i = round_robin(freq, n_plain, i, -1)
+        nsamples_in_freq -= n_plain
+    # at most len(freq) left: skip 1s so they do not go to 0
     while nsamples_in_freq > nsamples:
-        # while we are not all ones but our current index is 1
-        # move to a different index
         while freq[i] == 1 and nsamples_in_freq <= len(freq):
             i = (i + 1) % len(freq)
-
         freq[i] -= 1
         i = (i + 1) % len(freq)
-        nsamples_in_freq = sum(freq)
+        nsamples_in_freq -= 1
 
-    # if we have too few frequences, increase them
-    while nsamples_in_freq < nsamples:
-        freq[i] += 1
-        i = (i + 1) % len(freq)
-        nsamples_in_freq = sum(freq)
+    # if we have too few frequences, add one to each in turn
+    if nsamples_in_freq < nsamples:
+        round_robin(freq, nsamples - nsamples_in_freq, i, 1)
 
     return(freq)
 
@@ -89,24 +107,24 @@ def zeno_dichotomy(n):
     (similiar to Zeno's dichotomy paradox)
     """
     n = int(n)
-    if n <= 1:
-        return([1])
-    else:
-        n = int(n/2)
-        return [n] + zeno_dichotomy(n)
+    halves = []
+    while n > 1:
+        n = n // 2
+        halves.append(n)
+    return halves + [1]
 
 
-def list_to_length_n(inlist, nsamples, msg):
+def list_to_length_n(inlist, nsamples, msg, myrand=random):
     n = len(inlist)
     times_more = math.floor(nsamples/n)
     add_more = nsamples % n
-    orig = inlist
+    orig = list(inlist)
     out = inlist * times_more
 
     # we'll need to add at least one more (maybe truncatd) set of inlist
     # if we are mod==0, it should be full, set add_more to the full length
     if add_more != 0:
-        random.shuffle(orig)
+        myrand.shuffle(orig)
         out += orig[0:add_more]
 
     # print('%d * %d (+ %d)' % (n, times_more, add_more))
@@ -117,13 +135,16 @@ def reduce_sum(v):
     return(functools.reduce(lambda x, y: x + y, v))
 
 
-def rep_a_b_times(a, b):
+def rep_a_b_array(a, b) -> numpy.ndarray:
+    "each a[i] repeated b[i] times (negative b like 0)"
     if len(a) != len(b):
         raise ValueError("a and b have different lengths!")
+    counts = numpy.maximum(numpy.asarray(b, dtype=float).astype(int), 0)
+    return numpy.repeat(numpy.asarray(a), counts)
 
-    listoflist = [[a[i]]*int(b[i]) for i in range(len(a))]
-    r = reduce_sum(listoflist)
-    return(r)
+
+def rep_a_b_times(a, b):
+    return(rep_a_b_array(a, b).tolist())
 
 
 def print_uniq_c(arr):
@@ -0,0 +1,120 @@
+"""
+On-disk cache of fitted designs (--cache-dir).
+
+Parsing, building, and fitting the tree only depends on the description.
+The parsed AST and the FittedDesign (tree, settings, duration pools,
+branch template) are pickled to
+
+  cache_dir/<sha256 of version and normalized description>.pkl
+
+A file is a header line (magic, sha256 of the payload) then the pickle.
+Entries that do not check out (bad header or digest, can't unpickle,
+made for another description or version) are rebuilt and overwritten.
+Only point --cache-dir at a directory you trust: entries are pickles.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from .EventGrammar import normalize_desc, parse
+from .FittedDesign import FittedDesign
+from .generate import str_to_last_leaves
+from .instrument import stage
+
+# bump when what is pickled changes shape
+CACHE_FORMAT = 1
+MAGIC = b"genTaskTime-cache"
+
+
+def package_version() -> str:
+    from . import __version__
+    return __version__
+
+
+def cache_key(expstr: str) -> str:
+    "sha256 hex of cache format, package version, and normalized description"
+    key = "%d\n%s\n%s" % (CACHE_FORMAT, package_version(), normalize_desc(expstr))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def cache_path(cache_dir: os.PathLike, expstr: str) -> str:
+    return os.path.join(cache_dir, cache_key(expstr) + ".pkl")
+
+
+def read_entry(path: os.PathLike, expstr: str) -> FittedDesign | None:
+    """
+    @return the cached design, or None if missing, corrupt, or stale
+    """
+    try:
+        with open(path, "rb") as fh:
+            header = fh.readline().split()
+            payload = fh.read()
+    except FileNotFoundError:
+        return None
+    if len(header) != 2 or header[0] != MAGIC:
+        print("WARNING: cache entry '%s' has a bad header. rebuilding" % path)
+        return None
+    if hashlib.sha256(payload).hexdigest().encode() != header[1]:
+        print("WARNING: cache entry '%s' is corrupt. rebuilding" % path)
+        return None
+    try:
+        entry = pickle.loads(payload)
+    except Exception as err:
+        print("WARNING: cache entry '%s' could not be loaded (%s). rebuilding" % (path, err))
+        return None
+    if (not isinstance(entry, dict) or
+            entry.get("format") != CACHE_FORMAT or
+            entry.get("version") != package_version() or
+            entry.get("desc") != normalize_desc(expstr) or
+            not isinstance(entry.get("design"), FittedDesign)):
+        print("WARNING: cache entry '%s' is stale. rebuilding" % path)
+        return None
+    return entry["design"]
+
+
+def write_entry(path: os.PathLike, expstr: str, astobj, design: FittedDesign) -> None:
+    """
+    write to a temporary file then rename: array jobs sharing a cache
+    never see a partial entry
+    """
+    payload = pickle.dumps({"format": CACHE_FORMAT,
+                            "version": package_version(),
+                            "desc": normalize_desc(expstr),
+                            "ast": astobj,
+                            "design": design},
+                           protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha256(payload).hexdigest().encode()
+    cache_dir = os.path.dirname(path) or "."
+    (fd, tmp) = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(MAGIC + b" " + digest + b"\n")
+            fh.write(payload)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def cached_design(expstr: str, cache_dir: os.PathLike, verb=1) -> FittedDesign:
+    """
+    FittedDesign for expstr from cache_dir, built (and saved) if not there
+    @param cache_dir  created if it does not exist
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, expstr)
+    with stage("cache_load"):
+        design = read_entry(path, expstr)
+    if design is not None:
+        design.verb = verb
+        if verb > 1:
+            print("loaded fitted design from cache '%s'" % path)
+        return design
+
+    (last_leaves, settings) = str_to_last_leaves(expstr, verb)
+    design = FittedDesign(last_leaves, settings, verb)
+    with stage("cache_write"):
+        write_entry(path, expstr, parse(expstr), design)
+    if verb > 1:
+        print("saved fitted design to cache '%s'" % path)
+    return design
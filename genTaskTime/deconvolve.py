@@ -7,9 +7,7 @@
     -stim_label 1 good                                          \\
     -stim_times 2 g_fbk.1D GAM                                  \\
 """
-import re
-from .LastLeaves import LastLeaves
-from .EventNode import uniquenode
+from .LastLeaves import LastLeaves, branch_events
 
 
 def d_append(d: dict, k, v):
@@ -25,36 +23,37 @@ GLTDict = list[dict[str, str]]
 
 
 def extract_stims(last_leaves: LastLeaves) -> tuple[StimDictist, GLTDict]:
+    """
+    one stim per 1D file (event name) in the order first seen walking the leaves.
+    model is from the event's first node (the one with a duration).
+    @return (stims like {"name": "cue_A", "model": "GAM"},
+             glts like {"name": "cue", "formula": "cue_A+cue_B"})
+    """
     stim = {}
     glt = {}
-    for n in uniquenode(last_leaves):
-        if re.matches(r"__catch__\d+", n.name):
-            continue
-
-        name = n.name
-        model = n.model
-
-        # 0s dur are sub-events. they're 1D files will have parent name prefix
-        # and we'll probably want to model all as single event collapsed in parent
-        # use glt for that
-        if n.dur == 0:
-            parent = n.path[-2]
-            name = f"{parent.name}_{n.name}"
-            if parent.model != n.model:
-                model = parent.model
-            d_append(glt, parent.name, n.name)
+    for leaf in last_leaves:
+        for fname, nodes in branch_events(leaf):
+            name = "_".join(fname)
+            if name in stim:
+                continue
+            stim[name] = {"name": name, "model": nodes[0].model}
 
-        stim += {"name": name, "model": model}
+            # 0s dur are sub-events. they're 1D files will have parent name prefix
+            # and we'll probably want to model all as single event collapsed in parent
+            # use glt for that
+            if len(fname) > 1:
+                d_append(glt, fname[0], name)
 
     # sum subevent nodes to make glt to represent their shared parent
     # format like other GLTs parsed by the AST/gammar/user input
-    parent_glt = [{"name": k, "formula": "+".join(v)} for k, v in glt.items()]
-    return (stim, parent_glt)
+    parent_glt = [{"name": k, "formula": "+".join(v)}
+                  for k, v in glt.items() if len(v) > 1]
+    return (list(stim.values()), parent_glt)
 
 
 def decon(stims: StimDictist, parent_glt: GLTDict, settings: dict):
     cmd = f"""
-    -nodata {settings['total_dur']} {settings['tr']} \\
+    -nodata {int(round(settings['rundur'] / settings['tr']))} {settings['tr']} \\
     -polort 3 \\
     -num_stimts {len(stims)} \\
     """
@@ -69,7 +68,7 @@ def decon(stims: StimDictist, parent_glt: GLTDict, settings: dict):
     if len(all_glts) > 0:
         cmd += f"-num_glt {len(all_glts)} \\\n"
 
-    for glt in all_glts:
+    for i, glt in enumerate(all_glts):
         cmd += f'-glt_label {i+1} {glt["name"]} -gltsym "sym:{glt["formula"]}"\\\n'
 
     return cmd
@@ -0,0 +1,266 @@
+"""
+Design efficiency without forking AFNI.
+
+Builds the design matrix '3dDeconvolve -nodata' would (see deconvolve.decon):
+each stim's onsets convolved with its model's response sampled on the TR grid,
+plus polort legendre drift terms. Efficiency of a contrast c is
+  1/(c (X'X)^-1 c')
+for each stim (c picks its column) and each GLT (c from the sym formula).
+"""
+import re
+import numpy as np
+from .deconvolve import extract_stims
+from .LastLeaves import LastLeaves
+
+# AFNI's GAM(p,q) defaults. peak 1 at t = p*q
+GAM_P = 8.6
+GAM_Q = 0.547
+# BLOCK4: g(s) = s^4 exp(-s) / (4^4 exp(-4))
+BLOCK_SCALE = 4**4 * np.exp(-4)
+# responses are ~0 (<1e-10 of peak) this long after an event ends
+RESPONSE_SECONDS = 45
+# summaries of all contrasts Efficiency.score knows. any contrast label works too
+METRICS = ["mean", "min"]
+
+
+def gam(t: np.ndarray) -> np.ndarray:
+    """
+    AFNI GAM impulse response (t/(p*q))^p * exp(p - t/q). 0 before onset
+    """
+    t = np.maximum(t, 0)
+    return (t / (GAM_P * GAM_Q)) ** GAM_P * np.exp(GAM_P - t / GAM_Q)
+
+
+def block4_integral(t: np.ndarray) -> np.ndarray:
+    """
+    integral of the BLOCK4 impulse response from 0 to t. closed form:
+    int_0^t s^4 exp(-s) ds = 24 (1 - exp(-t) sum_{k=0..4} t^k/k!)
+    """
+    t = np.maximum(t, 0)
+    poly = 1 + t + t**2 / 2 + t**3 / 6 + t**4 / 24
+    return 24 * (1 - np.exp(-t) * poly) / BLOCK_SCALE
+
+
+def block(t: np.ndarray, dur: np.ndarray) -> np.ndarray:
+    """
+    BLOCK4(dur): response to dur seconds of stimulus starting at t=0.
+    amplitude grows with duration (dmBLOCK, BLOCK without a peak parameter)
+    """
+    return block4_integral(t) - block4_integral(t - dur)
+
+
+def block_peak(dur: np.ndarray) -> np.ndarray:
+    """
+    peak of block(t, dur). BLOCK4 response rises until t where
+    g(t) == g(t - dur). found on a 0.01s grid (fine for normalizing)
+    """
+    dur = np.atleast_1d(np.asarray(dur, dtype=float))
+    t = np.arange(0, dur.max() + 20, .01)
+    return block(t[:, np.newaxis], dur).max(axis=0)
+
+
+def response(model: str, t: np.ndarray, dur: np.ndarray) -> np.ndarray:
+    """
+    response at t seconds after onsets with durations dur for a 3dDeconvolve model
+      GAM     - gamma variate impulse. ignores duration
+      BLOCK   - BLOCK4(dur,1): peak normalized to 1
+      dmBLOCK - BLOCK4(dur): duration modulated amplitude
+    """
+    if model == "GAM":
+        return gam(t)
+    if model == "dmBLOCK":
+        return block(t, dur)
+    if model == "BLOCK":
+        (udur, idx) = np.unique(dur, return_inverse=True)
+        peak = block_peak(udur)[idx].reshape(np.shape(dur))
+        return block(t, dur) / np.where(peak > 0, peak, 1)
+    raise ValueError(f"efficiency: model '{model}' not supported (GAM, BLOCK, dmBLOCK)")
+
+
+def glt_contrast(formula: str, labels: list[str]) -> np.ndarray:
+    """
+    weights over labels for a gltsym formula like 'A+B', 'A - B', '.5*A-.5*B'
+    """
+    c = np.zeros(len(labels))
+    for term in re.findall(r"[+-]?[^+-]+", formula.replace(" ", "")):
+        sign = -1 if term[0] == "-" else 1
+        term = term.lstrip("+-")
+        coef = 1.0
+        if "*" in term:
+            (coef, term) = term.split("*", 1)
+            coef = float(coef)
+        if term not in labels:
+            raise ValueError(f"glt '{formula}': '{term}' is not a stim ({labels})")
+        c[labels.index(term)] += sign * coef
+    return c
+
+
+def event_arrays(event_df) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    "event, onset, dur columns as arrays"
+    return (np.asarray(event_df["event"]),
+            np.asarray(event_df["onset"], dtype=float),
+            np.asarray(event_df["dur"], dtype=float))
+
+
+def contrast_efficiency(X: np.ndarray, contrasts: np.ndarray) -> np.ndarray:
+    """
+    1/(c (X'X)^-1 c') for each row c of contrasts.
+    0 when the design cannot estimate it (singular X'X)
+    """
+    try:
+        xtx_inv = np.linalg.inv(X.T @ X)
+    except np.linalg.LinAlgError:
+        return np.zeros(len(contrasts))
+    var = np.einsum("cp,pq,cq->c", contrasts, xtx_inv, contrasts)
+    with np.errstate(divide="ignore"):
+        return np.where(var > 0, 1 / var, 0)
+
+
+def batch_contrast_efficiency(X: np.ndarray, contrasts: np.ndarray) -> np.ndarray:
+    """
+    contrast_efficiency for a K x T x P stack of design matrices.
+    c (X'X)^-1 c' == |L^-1 c'|^2 with X'X = L L' (cholesky), all K at once
+    @return K x ncontrasts
+    """
+    xtx = np.einsum("ktp,ktq->kpq", X, X)
+    try:
+        L = np.linalg.cholesky(xtx)
+    except np.linalg.LinAlgError:
+        # at least one candidate cannot estimate everything. score one by one
+        return np.array([contrast_efficiency(x, contrasts) for x in X])
+    rhs = np.broadcast_to(contrasts.T, (len(X),) + contrasts.T.shape)
+    var = (np.linalg.solve(L, rhs) ** 2).sum(axis=1)
+    with np.errstate(divide="ignore"):
+        return np.where(var > 0, 1 / var, 0)
+
+
+class Efficiency:
+    """
+    Regressor layout of a fit tree: one stim per event name (extract_stims)
+    and GLTs (parent sums from extract_stims + settings['glts']).
+    Build once, then score any iteration's events (event_df from triallist_to_df).
+
+    Columns of the design matrix are polort+1 drift terms then stims.
+    """
+
+    def __init__(self, last_leaves: LastLeaves, settings: dict, polort: int | None = None):
+        tr = settings.get("tr")
+        if not tr:
+            raise ValueError("efficiency: need a TR. add '@tr' to the settings like <300/40 @2>")
+        self.tr = tr
+        self.nvol = int(round(settings["rundur"] / tr))
+        self.frame_times = np.arange(self.nvol) * tr
+
+        # like 3dDeconvolve -polort A
+        if polort is None:
+            polort = 1 + int(settings["rundur"] / 150)
+        self.polort = polort
+        self.drift = np.polynomial.legendre.legvander(
+            np.linspace(-1, 1, self.nvol), polort)
+
+        (self.stims, parent_glts) = extract_stims(last_leaves)
+        self.glts = parent_glts + [dict(g) for g in settings.get("glts", [])]
+        self.labels = [s["name"] for s in self.stims]
+        self.models = [s["model"] for s in self.stims]
+
+        # contrast per stim then per glt. 0 weight for drift columns
+        nstim = len(self.stims)
+        stim_c = np.eye(nstim)
+        glt_c = [glt_contrast(g["formula"], self.labels) for g in self.glts]
+        c = np.vstack([stim_c] + glt_c) if glt_c else stim_c
+        self.contrasts = np.hstack([np.zeros((len(c), polort + 1)), c])
+        self.contrast_labels = self.labels + [g["name"] for g in self.glts]
+
+    def regressor(self, model: str, onsets: np.ndarray, durs: np.ndarray) -> np.ndarray:
+        """
+        sum of each onset's response on the TR grid
+        """
+        t = self.frame_times[:, np.newaxis] - np.asarray(onsets, dtype=float)
+        return response(model, t, np.asarray(durs, dtype=float)).sum(axis=1)
+
+    def design_matrix(self, event_df) -> np.ndarray:
+        """
+        @param event_df  dataframe with row per event. cols: event, onset, dur
+                         (or anything with those keys, like a dict of arrays)
+        @return nvol x (polort+1 + nstim) matrix
+        """
+        (events, onsets, durs) = event_arrays(event_df)
+        cols = [self.regressor(model, onsets[events == name], durs[events == name])
+                for name, model in zip(self.labels, self.models)]
+        return np.column_stack([self.drift] + cols)
+
+    def design_matrices(self, event_dfs) -> np.ndarray:
+        """
+        design matrices for K candidates (iterations of the same fit tree).
+        every candidate has the same stims/columns, only onsets (and durations) differ.
+        events of all candidates are scored together, each only on the frames
+        within RESPONSE_SECONDS of its end, and summed into place (bincount)
+        @param event_dfs  list of event_df like design_matrix takes
+        @return K x nvol x (polort+1 + nstim)
+        """
+        arrays = [event_arrays(e) for e in event_dfs]
+        K = len(arrays)
+        ndrift = self.polort + 1
+        X = np.empty((K, self.nvol, ndrift + len(self.labels)))
+        X[:, :, :ndrift] = self.drift
+
+        # stim column of every event. -1 for events without one (__iti__)
+        sorted_idx = np.argsort(self.labels)
+        sorted_labels = np.array(self.labels, dtype=object)[sorted_idx]
+        codes = []
+        for (events, _, _) in arrays:
+            pos = np.minimum(np.searchsorted(sorted_labels, events), len(sorted_labels) - 1)
+            codes.append(np.where(sorted_labels[pos] == events, sorted_idx[pos], -1))
+        cand = np.repeat(np.arange(K), [len(c) for c in codes])
+        codes = np.concatenate(codes) if codes else np.zeros(0, dtype=int)
+        onsets = np.concatenate([o for (_, o, _) in arrays]) if arrays else np.zeros(0)
+        durs = np.concatenate([d for (_, _, d) in arrays]) if arrays else np.zeros(0)
+
+        for col, model in enumerate(self.models):
+            m = codes == col
+            (k, o, d) = (cand[m], onsets[m], durs[m])
+            width = int(np.ceil((d.max(initial=0) + RESPONSE_SECONDS) / self.tr)) + 1
+            frames = np.ceil(o / self.tr - 1e-9).astype(int)[:, np.newaxis] + np.arange(width)
+            inrun = frames < self.nvol
+            vals = response(model, frames * self.tr - o[:, np.newaxis], d[:, np.newaxis])
+            X[:, :, ndrift + col] = np.bincount(
+                (k[:, np.newaxis] * self.nvol + frames)[inrun],
+                weights=vals[inrun], minlength=K * self.nvol).reshape(K, self.nvol)
+        return X
+
+    def batch_efficiency(self, event_dfs, chunk=256) -> np.ndarray:
+        """
+        efficiency of every contrast for many candidates at once
+        @param event_dfs  list of event_df like design_matrix takes
+        @param chunk      candidates per stack (bounds memory)
+        @return K x ncontrasts. columns in contrast_labels order
+        """
+        event_dfs = list(event_dfs)
+        effs = [batch_contrast_efficiency(self.design_matrices(event_dfs[i:i + chunk]),
+                                          self.contrasts)
+                for i in range(0, len(event_dfs), chunk)]
+        return np.vstack(effs) if effs else np.zeros((0, len(self.contrast_labels)))
+
+    def score(self, effs: np.ndarray, metric: str = "mean") -> np.ndarray:
+        """
+        one number per candidate to rank by (bigger is better)
+        @param effs    K x ncontrasts from batch_efficiency
+        @param metric  'mean' or 'min' over all contrasts, or a contrast label
+        @return K scores
+        """
+        effs = np.asarray(effs, dtype=float).reshape(-1, len(self.contrast_labels))
+        if metric == "mean":
+            return effs.mean(axis=1)
+        if metric == "min":
+            return effs.min(axis=1)
+        if metric in self.contrast_labels:
+            return effs[:, self.contrast_labels.index(metric)]
+        raise ValueError(f"efficiency: metric '{metric}' is not one of "
+                         f"{METRICS + self.contrast_labels}")
+
+    def efficiency(self, event_df) -> dict[str, float]:
+        """
+        @return efficiency keyed by stim and glt name
+        """
+        eff = contrast_efficiency(self.design_matrix(event_df), self.contrasts)
+        return dict(zip(self.contrast_labels, eff.tolist()))
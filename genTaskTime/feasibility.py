@@ -0,0 +1,322 @@
+"""
+Check a fitted design can fill its run before drawing any iteration.
+
+Each iteration's task time (events + miniti per trial) is the sum of the
+durations drawn from each node's pool (EventNode.fit_dur). The pools are
+fixed once the tree is fit, so the smallest, largest, and expected task
+time are known without drawing. add_itis and shuffle_triallist then need
+
+  rundur - pads - task >= 0                               (events fit)
+  rundur - pads - task - miniti*ntrial <= maxiti*ntrial   (add_itis)
+  int((rundur - pads - task)/granularity) <= maxfirst + ntrial*maxslots
+                                                          (iti_slot_caps)
+
+Both sides are monotone in task time: if the smallest and largest task
+times pass, every draw does. If neither can, the run is hopeless.
+
+p_maxiti is the chance that spreading the expected number of iti slots
+uniformly between the trials (shuffling them in with the trials) leaves no
+iti longer than maxiti. gap_vector draws from just those orders directly,
+but a small p_maxiti means maxiti, not chance, decides where itis go.
+
+  feas = check_feasible(design)
+  print(feas.report())
+  if feas.errors: sys.exit(1)
+"""
+import math
+from typing import NamedTuple
+import numpy as np
+from .FittedDesign import FittedDesign
+from .TrialList import iti_slot_caps
+
+
+class Feasibility(NamedTuple):
+    """
+    task times include miniti. iti times are what is left of the run after pads and task
+    """
+    ntrial: int
+    # rundur less start and stop pads
+    run_time: float
+    task_min: float
+    task_max: float
+    task_mean: float
+    task_sd: float
+    # most iti (beyond miniti) maxiti allows
+    iti_cap: float
+    # chance an iteration's draws fit (normal approximation). 1 or 0 when all or none do
+    p_fit: float
+    # see module docstring. at the expected number of slots
+    p_maxiti: float
+    errors: list[str]
+    warnings: list[str]
+    suggestions: list[str]
+
+    def report(self) -> str:
+        lines = [
+            "### feasibility",
+            "task time (events + miniti): min %.2f, expected %.2f (sd %.2f), max %.2f"
+            % (self.task_min, self.task_mean, self.task_sd, self.task_max),
+            "run time after pads: %.2f. iti to fill: %.2f to %.2f (maxiti allows up to %.2f)"
+            % (self.run_time, self.run_time - self.task_max,
+               self.run_time - self.task_min, self.iti_cap),
+            "draws that fit: %s. random order within maxiti: %s"
+            % (percent(self.p_fit), percent(self.p_maxiti)),
+        ]
+        lines += ["ERROR: %s" % x for x in self.errors]
+        lines += ["WARNING: %s" % x for x in self.warnings]
+        lines += ["\ttry %s" % x for x in self.suggestions]
+        return "\n".join(lines)
+
+
+def percent(p: float) -> str:
+    if p == 0:
+        return "0%"
+    if p < 1e-300:
+        return "<1e-300"
+    if p < 1e-4:
+        return "%.1e" % p
+    return "%.2f%%" % (100 * p)
+
+
+def node_task_range(pool: np.ndarray, base: np.ndarray, extra: int, need: int
+                    ) -> tuple[float, float, float, float]:
+    """
+    sum of the first need draws of a node (see EventNode.draw_dur):
+    a permutation of base plus extra picked from pool without replacement
+    @return (min, max, mean, variance)
+    """
+    n = len(base) + extra
+    k = min(need, n)
+    if k == 0:
+        return (0.0, 0.0, 0.0, 0.0)
+    pool = np.sort(pool)
+    low = np.sort(np.concatenate((base, pool[:extra])))
+    high = np.sort(np.concatenate((base, pool[len(pool) - extra:])))
+    mean = (base.sum() + extra * pool.mean()) / n
+    # k of n without replacement, plus the extra picked from the pool (of npool)
+    npool = len(pool)
+    var = k * pool.var() * (n - k) / (n - 1) if n > 1 else 0.0
+    if npool > 1:
+        var += (k / n) ** 2 * extra * pool.var() * (npool - extra) / (npool - 1)
+    return (float(low[:k].sum()), float(high[n - k:].sum()), float(k * mean), float(var))
+
+
+def iti_fits(iti_time: float, ntrial: int, settings: dict) -> bool:
+    "same checks as add_itis and shuffle_triallist for iti_time left after the task"
+    (maxfirst, maxslots) = iti_slot_caps(settings)
+    if settings["iti_never_first"]:
+        maxfirst = 0
+    nslots = int(iti_time / settings["granularity"])
+    return (iti_time >= 0 and
+            iti_time - settings["miniti"] * ntrial <= settings["maxiti"] * ntrial and
+            nslots <= maxfirst + ntrial * maxslots)
+
+
+def iti_cap(ntrial: int, settings: dict) -> float:
+    "most iti time iti_fits allows (to within granularity)"
+    (maxfirst, maxslots) = iti_slot_caps(settings)
+    if settings["iti_never_first"]:
+        maxfirst = 0
+    return min((settings["maxiti"] + settings["miniti"]) * ntrial,
+               (maxfirst + ntrial * maxslots) * settings["granularity"])
+
+
+# above about this many digit operations, p_gaps_within approximates
+EXACT_COST = 200_000
+
+
+def p_gaps_within(nslots: int, ntrial: int, maxslots: int, maxfirst: int | None) -> float:
+    """
+    share of the ways to put nslots slots into the gaps around ntrial trials
+    with no gap after a trial over maxslots and the first gap at most maxfirst
+    (maxfirst None: no gap before the first trial).
+    exact (inclusion-exclusion) when cheap, else a saddlepoint approximation
+    """
+    ngaps = ntrial + (maxfirst is not None)
+    if ngaps == 0:
+        return float(nslots == 0)
+    caps = [maxfirst] * (maxfirst is not None) + [maxslots]
+    counts = [1] * (maxfirst is not None) + [ntrial]
+    capacity = sum(c * k for (c, k) in zip(caps, counts))
+    if nslots > capacity:
+        return 0.0
+    # as many ways to fill n slots as to leave n empty
+    fill = min(nslots, capacity - nslots)
+    # unbounded ways to put nslots into ngaps gaps: comb(nslots + ngaps - 1, ngaps - 1)
+    log_all = math.lgamma(nslots + ngaps) - math.lgamma(nslots + 1) - math.lgamma(ngaps)
+
+    nterms = min(ntrial, fill // (maxslots + 1)) + 1
+    if nterms * min(fill, ngaps) <= EXACT_COST:
+        within = ways_within(fill, ngaps, ntrial, maxslots, maxfirst)
+        log_within = math.log(within) if within > 0 else None
+    else:
+        log_within = log_ways_saddle(fill, caps, counts)
+    if log_within is None:
+        return 0.0
+    # possible, but can be too small for a float
+    return max(math.exp(min(log_within - log_all, 0.0)), math.ulp(0))
+
+
+def ways_within(nslots: int, ngaps: int, ntrial: int, maxslots: int, maxfirst: int | None) -> int:
+    "exact count for p_gaps_within by inclusion-exclusion (big integers)"
+    def ways(n):
+        # unbounded ways to put n slots into ngaps gaps
+        return math.comb(n + ngaps - 1, ngaps - 1) if n >= 0 else 0
+
+    within = 0
+    for first_over in ((0, 1) if maxfirst is not None else (0,)):
+        left = nslots - first_over * (maxfirst + 1 if maxfirst is not None else 0)
+        for k in range(min(ntrial, max(left, -1) // (maxslots + 1)) + 1):
+            term = math.comb(ntrial, k) * ways(left - k * (maxslots + 1))
+            within += -term if (k + first_over) % 2 else term
+    return within
+
+
+def _capped_geometric(a: float, cap: int) -> tuple[float, float, float]:
+    """
+    P(v) ~ exp(-a*v) on 0..cap (a >= 0)
+    @return (log normalizer, mean, variance)
+    """
+    n = cap + 1
+    if a * n < 1e-4:
+        # about uniform
+        return (math.log(n) - a * cap / 2, cap / 2 - a * cap * (cap + 2) / 12,
+                cap * (cap + 2) / 12)
+    log_z = math.log(-math.expm1(-a * n)) - math.log(-math.expm1(-a))
+    mean = 1 / math.expm1(a) - n / math.expm1(a * n) if a * n < 700 else 1 / math.expm1(a)
+    var = 1 / (4 * math.sinh(a / 2) ** 2)
+    if a * n < 700:
+        var -= n * n / (4 * math.sinh(a * n / 2) ** 2)
+    return (log_z, mean, var)
+
+
+def log_ways_saddle(nslots: int, caps: list[int], counts: list[int]) -> float:
+    """
+    log of the ways to put nslots into gaps, counts[i] of them each at most caps[i].
+    saddlepoint: tilt each gap to exp(-a*v) so their sum averages nslots.
+    needs nslots <= half of capacity (a >= 0)
+    """
+    def total(a):
+        stats = [(k, _capped_geometric(a, c)) for (c, k) in zip(caps, counts)]
+        return (sum(k * s[0] for (k, s) in stats), sum(k * s[1] for (k, s) in stats),
+                sum(k * s[2] for (k, s) in stats))
+
+    # mean falls as a grows. bisect on log(a)
+    (lo, hi) = (math.log(1e-12), math.log(50.0))
+    if total(0.0)[1] <= nslots:
+        a = 0.0
+    else:
+        for _ in range(80):
+            mid = (lo + hi) / 2
+            if total(math.exp(mid))[1] > nslots:
+                lo = mid
+            else:
+                hi = mid
+        a = math.exp((lo + hi) / 2)
+    (log_z, _, var) = total(a)
+    return a * nslots + log_z - 0.5 * math.log(2 * math.pi * max(var, 1e-12))
+
+
+def suggest(feas: dict, settings: dict, pads: float) -> list[str]:
+    """
+    rundur, ntrial, and iti: settings that fit every draw of this design.
+    ntrial is approximate: the tree may only fit some trial counts evenly
+    """
+    tips = []
+    (n, run) = (feas["ntrial"], feas["run_time"])
+    (tmin, tmax) = (feas["task_min"], feas["task_max"])
+    (miniti, gran) = (settings["miniti"], settings["granularity"])
+    cap = feas["iti_cap"]
+
+    if tmax - tmin <= cap:
+        tips.append("rundur between %.2f and %.2f (pads %.2f)" %
+                    (tmax + pads, tmin + cap + pads, pads))
+
+    # per trial, not counting miniti
+    per_trial = (feas["task_mean"] / n - miniti) if n else 0
+    if per_trial + miniti > 0:
+        fit = [m for m in range(1, int(run / (per_trial + miniti)) + 1)
+               if iti_fits(run - m * (per_trial + miniti), m, settings)]
+        if fit:
+            tips.append("about %s trials (each ~%.2f + miniti %.2f)" %
+                        ("%d to %d" % (fit[0], fit[-1]) if len(fit) > 1 else fit[0],
+                         per_trial, miniti))
+
+    iti = []
+    if tmax > run and n:
+        # largest miniti (on the granularity) that still fits the longest draw
+        most = math.floor((miniti - (tmax - run) / n) / gran + 1e-6) * gran
+        if most >= 0:
+            iti.append("miniti at most %g" % most)
+    elif not iti_fits(run - tmin, n, settings) and n:
+        # smallest maxiti (on the granularity) that fills the shortest draw
+        # need about (iti + n*miniti)/(n+1) when the first gap can hold maxiti
+        maxiti = math.floor(((run - tmin + n * miniti) / (n + 1)) / gran) * gran
+        while not iti_fits(run - tmin, n, {**settings, "maxiti": maxiti}):
+            maxiti += gran
+        iti.append("iti:%g-%g" % (miniti, round(maxiti / gran) * gran))
+    tips += iti
+    return tips
+
+
+def check_feasible(design: FittedDesign) -> Feasibility:
+    """
+    task time range of a fitted design against its run settings. nothing is drawn
+    """
+    settings = design.settings
+    template = design.template
+    ntrial = len(template.offsets) - 1
+    pads = settings.get("startpad", 0) + settings.get("stoppad", 0)
+    run_time = float(settings["rundur"]) - pads
+
+    # miniti rows
+    fixed = float(template.base_dur.sum())
+    ranges = np.array([node_task_range(np.asarray(n.dur_pool, dtype=float),
+                                       np.asarray(n.dur_base, dtype=float),
+                                       n.dur_extra, need)
+                       for (n, need) in zip(template.nodes, template.node_need.tolist())
+                       ]).reshape(-1, 4)
+    (task_min, task_max, task_mean, task_var) = ranges.sum(axis=0) + (fixed, fixed, fixed, 0)
+    task_sd = math.sqrt(task_var)
+    cap = iti_cap(ntrial, settings)
+
+    ok_min = iti_fits(run_time - task_min, ntrial, settings)
+    ok_max = iti_fits(run_time - task_max, ntrial, settings)
+    (errors, warnings) = ([], [])
+    if task_min > run_time:
+        errors.append("shortest task time (%.2f) is longer than the run (%.2f)" %
+                      (task_min, run_time))
+    elif task_max <= run_time and not ok_max:
+        errors.append("longest task time (%.2f) leaves %.2f of iti. maxiti %g allows %.2f" %
+                      (task_max, run_time - task_max, settings["maxiti"], cap))
+    if not errors and not ok_max:
+        warnings.append("longest task time (%.2f) does not fit the run (%.2f): "
+                        "a draw like that stops the run" % (task_max, run_time))
+    if not errors and not ok_min:
+        warnings.append("shortest task time (%.2f) leaves %.2f of iti. maxiti %g allows %.2f: "
+                        "iterations like that are skipped" %
+                        (task_min, run_time - task_min, settings["maxiti"], cap))
+
+    if errors:
+        p_fit = 0.0
+    elif ok_min and ok_max:
+        p_fit = 1.0
+    elif task_sd == 0:
+        p_fit = float(iti_fits(run_time - task_mean, ntrial, settings))
+    else:
+        # task time within [run_time - cap, run_time]
+        def phi(x):
+            return 0.5 * (1 + math.erf((x - task_mean) / (task_sd * math.sqrt(2))))
+        p_fit = phi(run_time) - phi(run_time - cap)
+
+    (maxfirst, maxslots) = iti_slot_caps(settings)
+    nslots = int(max(run_time - task_mean, 0) / settings["granularity"])
+    p_maxiti = p_gaps_within(nslots, ntrial, maxslots,
+                             None if settings["iti_never_first"] else maxfirst)
+
+    feas = dict(ntrial=ntrial, run_time=run_time, task_min=float(task_min),
+                task_max=float(task_max), task_mean=float(task_mean), task_sd=task_sd,
+                iti_cap=cap, p_fit=p_fit, p_maxiti=p_maxiti,
+                errors=errors, warnings=warnings)
+    feas["suggestions"] = suggest(feas, settings, pads) if errors or warnings else []
+    return Feasibility(**feas)
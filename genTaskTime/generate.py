@@ -1,55 +1,323 @@
 #!/usr/bin/env python3
 
 # -*- coding: utf-8 -*-
+from __future__ import annotations
+
 import anytree
+import concurrent.futures
+import functools
+import heapq
+import itertools
+import numpy as np
 import pprint
+import random
+import sys
+from typing import TYPE_CHECKING, Iterator, NamedTuple
 from .EventGrammar import unlist_grammar, parse, parse_settings
 from .LastLeaves import LastLeaves, events_to_tree
-import os.path
-import copy
-from .TrialList import shuffle_triallist, triallist_to_df, df_to_1D
-# import itertools
+from .FittedDesign import FittedDesign
+from .TrialList import triallist_to_df, write_event_df, triallist_to_arrays, event_rows, iti_list
+from .efficiency import Efficiency
+from .store import StoreWriter
+from .manifest import Manifest, read_manifest
+from .shard import shard_range, write_shard_info
+from .writer import BackgroundWriter
+from .instrument import PROFILE, stage, count
+
+if TYPE_CHECKING:
+    # only needed to make dataframes. not imported by -n (dry run)
+    import pandas as pd
 
+# candidates scored together (Efficiency.batch_efficiency) in keep_best_trials
+SCORE_CHUNK = 128
 
-def write_trials(last_leaves: LastLeaves, settings: dict, n_iterations=1000, verb=1) -> None:
+
+def iteration_seed(base_seed: int, iter_i: int) -> int:
     """
-    Write n_interations folders (folder name = random seed).
-    Must create a deep copy of LastLeaves struct before applying shuffle_trials
+    seed for iteration iter_i of a run started from base_seed.
+    child iter_i of SeedSequence(base_seed).spawn(), built directly
+    so any iteration can be made without making all the ones before it.
+    @return int < 2**63, used for the folder name and FittedDesign.draw
     """
-    start_at_time = settings.get("startpad", 0)
+    ss = np.random.SeedSequence(base_seed, spawn_key=(iter_i,))
+    (hi, lo) = ss.generate_state(2, np.uint32)
+    return ((int(hi) << 32) | int(lo)) >> 1
 
-    # set file name to seed
-    # int(math.log10(sys.maxsize)) -- 18 digits
-    for iter_i in range(0, n_iterations):
-        # get a new trial list
-        lastleaves_i = copy.copy(last_leaves)
-        triallist = lastleaves_i.to_triallist(settings, verb)
-        # shuffle with seed
-        (triallist, seed) = shuffle_triallist(settings, triallist)
-        # could not find a shuffle that worked!
+
+class Design(NamedTuple):
+    """
+    one iteration, in memory. event/onset/dur are the rows triallist_to_df would
+    make (itis as '__iti__'). d._asdict() works where an event_df is expected
+    (Efficiency.design_matrix, batch_efficiency)
+    """
+    seed: int
+    event: np.ndarray
+    onset: np.ndarray
+    dur: np.ndarray
+    # collapsed iti durations between events (TrialList.iti_list)
+    itis: list[float]
+
+    def event_df(self) -> pd.DataFrame:
+        "same as triallist_to_df for this iteration"
+        import pandas as pd
+        return pd.DataFrame({"event": self.event, "onset": self.onset, "dur": self.dur})
+
+
+def iter_designs(expstr: str, n: int, seed: int | None = None, verb=0) -> Iterator[Design]:
+    """
+    lazily draw n iterations of a task description. nothing is written.
+    same seed gives the same iterations (and seeds) as write_trials.
+    iterations without a shuffle that fits are skipped, so fewer than n may come out
+    @param expstr  task description like '<30/5> first=[2]; next=[1](2x Left, Right)'
+    @param seed    base seed (see iteration_seed). None for random
+    """
+    (last_leaves, settings) = str_to_last_leaves(expstr, verb)
+    design = FittedDesign(last_leaves, settings, verb)
+    start_at_time = settings.get("startpad", 0)
+    if seed is None:
+        seed = random.randrange(sys.maxsize)
+    for i in range(n):
+        (triallist, iter_seed) = design.draw(iteration_seed(seed, i))
         if triallist is None:
             continue
+        rows = event_rows(*triallist_to_arrays(triallist), start_at_time)
+        yield Design(iter_seed, *rows, iti_list(triallist))
+
+
+def draw_event_df(design: FittedDesign, seed: int) -> tuple[int, pd.DataFrame] | None:
+    """
+    draw one iteration from a fit design
+    @return (seed, event dataframe) or None if no shuffle fit
+    """
+    # new durations and shuffle with seed
+    (triallist, seed) = design.draw(seed)
+    count("iterations")
+    # could not find a shuffle that worked!
+    if triallist is None:
+        count("failed_iterations")
+        return None
+    with stage("df"):
+        return (seed, triallist_to_df(triallist, design.settings.get("startpad", 0)))
+
 
-        # save to iteration specific directory
-        savedir = "%018d" % seed
-        os.makedirs(savedir, exist_ok=True)
+def write_drawn(drawn: tuple[int, pd.DataFrame] | None) -> int | None:
+    """
+    write draw_event_df's iteration to a folder named by its seed
+    @return seed or None if nothing was drawn
+    """
+    if drawn is None:
+        return None
+    # save to iteration specific directory
+    (seed, edf) = drawn
+    write_event_df(edf, "%018d" % seed)
+    # TODO: run 3dDeconvolve
+    return seed
 
-        edf = triallist_to_df(triallist, start_at_time)
-        edf.to_csv(
-            os.path.join(savedir, "event_onset_duration.tsv"),
-            sep="\t",
-            index=False,
-            float_format="%.3f",
-        )
 
-        # write out 1D timing files. likely for AFNI's '3dDeconvolve -nodata'
-        df_to_1D(edf, savedir)
+def write_iteration(design: FittedDesign, seed: int) -> int | None:
+    """
+    draw one iteration from a fit design and write it to a folder named by seed
+    @return seed or None if no shuffle fit
+    """
+    return write_drawn(draw_event_df(design, seed))
+
+
+def score_iterations(state: tuple[FittedDesign, Efficiency], seeds: list[int]) -> list[tuple[int, np.ndarray]]:
+    """
+    draw each seed's iteration and score it. nothing is written
+    @param state  (design, efficiency) built once for the tree
+    @return (seed, efficiency of each contrast) for the seeds with a shuffle that fit
+    """
+    (design, eff) = state
+    drawn = [d for d in (draw_event_df(design, s) for s in seeds) if d is not None]
+    with stage("score"):
+        effs = eff.batch_efficiency([edf for _, edf in drawn])
+    return [(s, row) for (s, _), row in zip(drawn, effs)]
+
 
-        # TODO: run 3dDeconvolve
+# each worker process gets the fit design (state) once (initializer), not once per task
+_WORKER_STATE = None
 
-        # print a message very 100 trials
-        if iter_i % 100 == 0 and verb > 0:
-            print("finished %d" % iter_i)
+
+def _init_worker(state, profile=False) -> None:
+    global _WORKER_STATE
+    _WORKER_STATE = state
+    PROFILE.enabled = profile
+
+
+def _worker_call(func, item):
+    if not PROFILE.enabled:
+        return func(_WORKER_STATE, item)
+    # send this task's stage times and counters back with the result
+    PROFILE.reset()
+    res = func(_WORKER_STATE, item)
+    return (res, PROFILE.snapshot())
+
+
+def map_iterations(func, state, items, jobs=1, chunksize=1):
+    """
+    func(state, item) for each item, in order. with jobs > 1 spread over
+    processes that each get state once. func must be a module level function
+    """
+    if jobs <= 1:
+        for item in items:
+            yield func(state, item)
+        return
+    profile = PROFILE.enabled
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(state, profile)) as executor:
+        results = executor.map(functools.partial(_worker_call, func), items,
+                               chunksize=chunksize)
+        if not profile:
+            yield from results
+            return
+        for (res, snap) in results:
+            PROFILE.merge(snap)
+            yield res
+
+
+def chunked(items, n):
+    "lists of n items (last one shorter)"
+    it = iter(items)
+    while chunk := list(itertools.islice(it, n)):
+        yield chunk
+
+
+def keep_best_trials(design: FittedDesign, seeds, n_iterations: int, keep_best: int,
+                     metric="mean", verb=1, jobs=1, store: StoreWriter | None = None) -> list[tuple[float, int]]:
+    """
+    score every iteration but only write the keep_best highest scoring.
+    scores for all seeds go to scores.tsv as they come in. a min-heap holds
+    (score, seed) of the current best, winners are redrawn from their seed at the end.
+    @param store  write winners here instead of to folders
+    @return [(score, seed)] of winners, best first
+    """
+    eff = Efficiency(design.last_leaves, design.settings)
+    # bad metric should fail before any work
+    eff.score(np.zeros((0, len(eff.contrast_labels))), metric)
+
+    best: list[tuple[float, int]] = []
+    n_done = 0
+    chunks = chunked(seeds, SCORE_CHUNK)
+    with open("scores.tsv", "w") as fh:
+        fh.write("\t".join(["seed", "score"] + eff.contrast_labels) + "\n")
+        for scored in map_iterations(score_iterations, (design, eff), chunks, jobs):
+            n_prev = n_done
+            n_done = min(n_done + SCORE_CHUNK, n_iterations)
+            if verb > 0 and n_done // 100 > n_prev // 100:
+                print("finished %d" % n_done)
+            if not scored:
+                continue
+            scores = eff.score(np.array([row for _, row in scored]), metric)
+            for (s, row), score in zip(scored, scores.tolist()):
+                fh.write("%018d\t%.6g\t" % (s, score) +
+                         "\t".join("%.6g" % x for x in row) + "\n")
+                if len(best) < keep_best:
+                    heapq.heappush(best, (score, s))
+                else:
+                    heapq.heappushpop(best, (score, s))
+
+    best.sort(reverse=True)
+    for (score, s) in best:
+        if store is not None:
+            with stage("store"):
+                store.append(*draw_event_df(design, s))
+        else:
+            write_iteration(design, s)
+        if verb > 0:
+            print("kept %018d %s=%.4g" % (s, metric, score))
+    return best
+
+
+def write_trials(last_leaves: LastLeaves, settings: dict, n_iterations=1000, verb=1,
+                 seed=None, jobs=1, keep_best=None, metric="mean", store=None,
+                 design: FittedDesign | None = None, manifest=None,
+                 shard: tuple[int, int] | None = None, writers=2) -> None:
+    """
+    Write n_interations folders (folder name = random seed).
+    Tree is fit once (FittedDesign). Each iteration only redraws durations
+    and trial order, both from the seed used as the folder name.
+
+    @param seed  base seed. iteration seeds are derived from it (iteration_seed)
+                 the same seed writes the same folders regardless of jobs
+    @param jobs  number of processes to spread iterations over
+    @param keep_best  only write this many, the best by metric (keep_best_trials)
+    @param metric     what keep_best ranks by. see Efficiency.score
+    @param store      directory to append all iterations to (StoreWriter)
+                      instead of a folder per iteration
+    @param design     last_leaves already fit to settings (cache.cached_design)
+    @param manifest   file to record finished iterations in (Manifest).
+                      iterations already in it are skipped (resume).
+                      its base seed is used if seed is None
+    @param shard      (i, N): only write shard i of N's slice of the iterations
+                      and shard.json for merge_shards (see shard.py)
+    @param writers    threads writing folders while the next iterations are drawn
+                      (BackgroundWriter). 0 to write in line. with jobs > 1 each
+                      worker process writes its own. a store is appended by one thread
+    """
+    if manifest and (keep_best or store):
+        raise ValueError("resuming from a manifest only works writing a folder " +
+                         "per iteration (not with keep_best or store)")
+    if design is None:
+        design = FittedDesign(last_leaves, settings, verb)
+
+    if seed is None and manifest:
+        seed = read_manifest(manifest)[0]
+    if seed is None:
+        seed = random.randrange(sys.maxsize)
+    if verb > 0:
+        print("base seed %d" % seed)
+
+    # set file name to seed
+    # int(math.log10(sys.maxsize)) -- 18 digits
+    todo = range(n_iterations)
+    if shard:
+        todo = shard_range(n_iterations, *shard, SCORE_CHUNK)
+    done = Manifest(manifest, seed) if manifest else None
+    if done is not None:
+        ntodo = len(todo)
+        todo = [i for i in todo if i not in done.done]
+        if verb > 0 and len(todo) < ntodo:
+            print("resuming: %d of %d iterations already done" %
+                  (ntodo - len(todo), ntodo))
+    seeds = (iteration_seed(seed, i) for i in todo)
+    writer = StoreWriter(store) if store else None
+    kept = None
+    try:
+        if keep_best:
+            kept = keep_best_trials(design, seeds, len(todo), keep_best, metric, verb, jobs,
+                                    store=writer)
+        else:
+            chunksize = max(1, min(100, n_iterations // (jobs * 4)))
+            if writer is not None:
+                (func, write, nthreads) = (draw_event_df, writer.append_drawn, min(writers, 1))
+            elif jobs > 1:
+                (func, write, nthreads) = (write_iteration, None, 0)
+            else:
+                (func, write, nthreads) = (draw_event_df, write_drawn, writers)
+
+            def finish(iter_i, res):
+                if write is not None:
+                    res = write(res)
+                if done is not None:
+                    done.add(iter_i, iteration_seed(seed, iter_i), res is not None)
+
+            results = map_iterations(func, design, seeds, jobs, chunksize)
+            with BackgroundWriter(nthreads) as background:
+                for iter_i, res in zip(todo, results):
+                    background.put(finish, iter_i, res)
+                    # print a message very 100 trials
+                    if iter_i % 100 == 0 and verb > 0:
+                        print("finished %d" % iter_i)
+    finally:
+        if writer is not None:
+            writer.close()
+        if done is not None:
+            done.close()
+    if shard:
+        write_shard_info(".", {"shard": shard[0], "nshard": shard[1], "seed": seed,
+                               "n_iterations": n_iterations, "keep_best": keep_best,
+                               "metric": metric, "store": bool(store), "kept": kept})
 
 
 def parse_events(astobj):
@@ -61,10 +329,12 @@ def parse_events(astobj):
 
 
 def str_to_last_leaves(expstr, verb=1):
-    astobj = parse(expstr)
+    with stage("parse"):
+        astobj = parse(expstr)
     events = parse_events(astobj)
     # build a tree from events
-    last_leaves = events_to_tree(events, verb)
+    with stage("tree"):
+        last_leaves = events_to_tree(events, verb)
     # list events
     settings = parse_settings(astobj)
     return (last_leaves, settings)
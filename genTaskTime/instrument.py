@@ -0,0 +1,121 @@
+"""
+Stage timers and counters for --profile.
+
+  with stage("shuffle"):
+      ...
+  count("failed_iterations")
+
+Both do (almost) nothing until enable() is called: stage() hands back one
+shared no-op context manager and count() returns after a single attribute check.
+Worker processes keep their own PROFILE. map_iterations sends each task's
+snapshot() back to be merge()d into the parent's.
+"""
+import json
+import threading
+import time
+
+
+class Profile:
+    "wall seconds and calls per stage, plus named counters"
+
+    def __init__(self):
+        self.enabled = False
+        # stages and counts also come from writer threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.seconds: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+        self.counters: dict[str, int] = {}
+
+    def add_time(self, name: str, secs: float) -> None:
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + secs
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"seconds": dict(self.seconds), "calls": dict(self.calls),
+                    "counters": dict(self.counters)}
+
+    def merge(self, snap: dict) -> None:
+        "add a snapshot (from another process) into this one"
+        # writer threads can be adding to the same dicts
+        with self.lock:
+            for (name, secs) in snap["seconds"].items():
+                self.seconds[name] = self.seconds.get(name, 0.0) + secs
+            for (name, n) in snap["calls"].items():
+                self.calls[name] = self.calls.get(name, 0) + n
+            for (name, n) in snap["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> str:
+        """
+        table of stages (by total time) then counters.
+        with -j, stage times are summed over processes and can exceed wall time
+        """
+        lines = ["%-16s %8s %10s %10s" % ("stage", "calls", "total_s", "mean_ms")]
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            secs = self.seconds[name]
+            lines.append("%-16s %8d %10.3f %10.3f" %
+                         (name, self.calls[name], secs, 1000 * secs / self.calls[name]))
+        for name in sorted(self.counters):
+            lines.append("%-16s %8d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as fh:
+            json.dump(self.snapshot(), fh, indent=1)
+
+
+PROFILE = Profile()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        PROFILE.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    "context manager timing the block as stage name (when enabled)"
+    if not PROFILE.enabled:
+        return _NO_STAGE
+    return _Stage(name)
+
+
+def count(name: str, n: int = 1) -> None:
+    "add n to counter name (when enabled)"
+    if not PROFILE.enabled:
+        return
+    with PROFILE.lock:
+        PROFILE.counters[name] = PROFILE.counters.get(name, 0) + n
+
+
+def enable(on: bool = True) -> Profile:
+    "start (or stop) collecting. clears anything collected so far"
+    PROFILE.enabled = on
+    PROFILE.reset()
+    return PROFILE
@@ -0,0 +1,95 @@
+"""
+Manifest of finished iterations for resuming a run (--resume).
+
+Iteration i of a run always has seed iteration_seed(base_seed, i), so a run
+can pick up where it stopped if it knows the base seed and which i are done.
+
+  # genTaskTime manifest base_seed 1234
+  0	8906532558624107687	1
+  1	2317455862410768755	0        <- no shuffle fit, nothing written
+  ...
+
+One line per iteration (index, seed, written?) appended after its files
+are written. Lines are buffered and flushed every MANIFEST_BATCH: after a
+kill, at most that many iterations are redone (same seeds, same files).
+"""
+import os
+import threading
+
+MANIFEST_BATCH = 256
+MANIFEST_HEADER = "# genTaskTime manifest base_seed"
+
+
+def read_manifest(path: os.PathLike) -> tuple[int | None, set[int]]:
+    """
+    @return (base seed or None if no manifest, iteration indices done)
+    a partly written last line (killed mid write) is ignored
+    """
+    if not os.path.exists(path):
+        return (None, set())
+    with open(path) as fh:
+        header = fh.readline()
+        if not header.startswith(MANIFEST_HEADER):
+            raise ValueError(f"{path} is not a genTaskTime manifest")
+        base_seed = int(header[len(MANIFEST_HEADER):])
+        done = set()
+        for line in fh:
+            cols = line.split()
+            if line.endswith("\n") and len(cols) == 3:
+                done.add(int(cols[0]))
+    return (base_seed, done)
+
+
+class Manifest:
+    """
+    append-only record of finished iterations. use as a context manager
+    so the last batch is flushed on the way out (also on errors)
+
+    @param path       manifest file. continued if it exists
+    @param base_seed  must match an existing manifest's
+    """
+
+    def __init__(self, path: os.PathLike, base_seed: int):
+        (old_seed, self.done) = read_manifest(path)
+        if old_seed is not None and old_seed != base_seed:
+            raise ValueError(f"{path} is for base seed {old_seed}, not {base_seed}")
+        self.buffer: list[str] = []
+        # add() can come from writer threads
+        self.lock = threading.Lock()
+        self.fh = open(path, "a")
+        if old_seed is None:
+            self.fh.write("%s %d\n" % (MANIFEST_HEADER, base_seed))
+        elif self.fh.tell() > 0 and not ends_with_newline(path):
+            # finish the partial line from a killed run
+            self.fh.write("\n")
+        self.fh.flush()
+
+    def add(self, iter_i: int, seed: int, written: bool) -> None:
+        with self.lock:
+            self.buffer.append("%d\t%d\t%d\n" % (iter_i, seed, written))
+            self.done.add(iter_i)
+            if len(self.buffer) >= MANIFEST_BATCH:
+                self.flush()
+
+    def flush(self) -> None:
+        self.fh.write("".join(self.buffer))
+        self.fh.flush()
+        self.buffer = []
+
+    def close(self) -> None:
+        if self.fh.closed:
+            return
+        self.flush()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def ends_with_newline(path: os.PathLike) -> bool:
+    with open(path, "rb") as fh:
+        fh.seek(-1, os.SEEK_END)
+        return fh.read(1) == b"\n"
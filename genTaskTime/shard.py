@@ -0,0 +1,126 @@
+"""
+Spread one run over machines (--shard i/N) and put it back together (merge).
+
+Iteration k of a run has seed iteration_seed(base_seed, k) (see generate.py),
+so shard i of N runs its own contiguous slice of k with the same base seed.
+Slices are whole blocks of SCORE_CHUNK iterations: keep-best scores the same
+batches a single run would.
+
+Each shard also writes shard.json (what was run and, for keep-best, the exact
+scores of its winners). merge_shards checks the shards make one full run
+and writes what that single run would have:
+  folders   every shard's seed folders
+  store     shard stores appended in order (one events.npy, index.npy, names.txt)
+  keep-best scores.tsv in iteration order and the best K overall
+"""
+import json
+import os
+import shutil
+from .store import StoreWriter, EventStore
+
+SHARD_FILE = "shard.json"
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """
+    @param spec  'i/N' with 0 <= i < N
+    @return (i, N)
+    """
+    try:
+        (i, n) = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"shard '{spec}' is not like i/N (e.g. 0/4)")
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"shard '{spec}': need 0 <= i < N")
+    return (i, n)
+
+
+def shard_range(n_iterations: int, shard: int, nshard: int, block: int) -> range:
+    "iteration indices for shard of nshard: a contiguous run of whole blocks of block"
+    nblocks = -(-n_iterations // block)
+    start = shard * nblocks // nshard * block
+    stop = (shard + 1) * nblocks // nshard * block
+    return range(min(start, n_iterations), min(stop, n_iterations))
+
+
+def write_shard_info(path: os.PathLike, info: dict) -> None:
+    with open(os.path.join(path, SHARD_FILE), "w") as fh:
+        json.dump(info, fh, indent=1)
+
+
+def read_shard_infos(dirs: list[str]) -> list[dict]:
+    """
+    @return shard.json of each dir, in shard order
+    raises ValueError unless the dirs are each shard of one run exactly once
+    """
+    infos = []
+    for d in dirs:
+        try:
+            with open(os.path.join(d, SHARD_FILE)) as fh:
+                info = json.load(fh)
+        except FileNotFoundError:
+            raise ValueError(f"{d} has no {SHARD_FILE}. not made with --shard?")
+        info["dir"] = d
+        infos.append(info)
+    run = ("seed", "nshard", "n_iterations", "keep_best", "metric", "store")
+    for info in infos[1:]:
+        for k in run:
+            if info[k] != infos[0][k]:
+                raise ValueError(f"{info['dir']} and {infos[0]['dir']} are from different "
+                                 f"runs ({k}: {info[k]} vs {infos[0][k]})")
+    infos.sort(key=lambda x: x["shard"])
+    have = [x["shard"] for x in infos]
+    if have != list(range(infos[0]["nshard"])):
+        raise ValueError(f"need each of {infos[0]['nshard']} shards once. have {have}")
+    return infos
+
+
+def merge_shards(dirs: list[str], outdir: os.PathLike) -> list[int]:
+    """
+    combine shard outputs into what one run with the same seed would write
+    @param dirs    output directory of every shard (any order)
+    @param outdir  created if needed
+    @return seeds written (for keep-best, the winners best first)
+    """
+    if not dirs:
+        raise ValueError("no shard directories to merge")
+    infos = read_shard_infos(dirs)
+    os.makedirs(outdir, exist_ok=True)
+    keep_best = infos[0]["keep_best"]
+
+    if keep_best:
+        # scores.tsv: shard slices are in iteration order
+        with open(os.path.join(outdir, "scores.tsv"), "w") as out:
+            for i, info in enumerate(infos):
+                with open(os.path.join(info["dir"], "scores.tsv")) as fh:
+                    header = fh.readline()
+                    if i == 0:
+                        out.write(header)
+                    shutil.copyfileobj(fh, out)
+        # same (score, seed) order as the heap in keep_best_trials
+        kept = sorted(((score, seed, info["dir"]) for info in infos
+                       for (score, seed) in info["kept"]), reverse=True)[:keep_best]
+        picks = [(seed, d) for (_, seed, d) in kept]
+    else:
+        picks = None
+
+    if infos[0]["store"]:
+        with StoreWriter(outdir) as writer:
+            if picks is None:
+                for info in infos:
+                    writer.append_store(EventStore(info["dir"]))
+                return [s for info in infos for s in EventStore(info["dir"]).seeds.tolist()]
+            stores = {info["dir"]: EventStore(info["dir"]) for info in infos}
+            for (seed, d) in picks:
+                writer.append_store(stores[d], [seed])
+        return [seed for (seed, _) in picks]
+
+    if picks is None:
+        picks = [(int(f), info["dir"]) for info in infos for f in sorted(os.listdir(info["dir"]))
+                 if f.isdigit() and os.path.isdir(os.path.join(info["dir"], f))]
+    for (seed, d) in picks:
+        folder = "%018d" % seed
+        shutil.copytree(os.path.join(d, folder), os.path.join(outdir, folder),
+                        dirs_exist_ok=True)
+    return [seed for (seed, _) in picks]
+
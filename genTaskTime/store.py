@@ -0,0 +1,205 @@
+"""
+Every iteration's events in one place instead of a folder per seed.
+
+A store is a directory of
+  events.npy  row per event: code, onset, dur (all iterations back to back)
+  index.npy   row per iteration: seed, offset (first row in events), count
+  names.txt   event name for each code, one per line
+
+The .npy files are appended to while iterations come in and only get their
+final shape in the (fixed size) header on close. Read with np.load(mmap_mode='r')
+(EventStore) and write selected seeds back out as folders with export_store.
+"""
+from __future__ import annotations
+
+import functools
+import os
+import struct
+from typing import TYPE_CHECKING
+import numpy as np
+from .TrialList import write_event_df
+from .instrument import count, stage
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+EVENT_DTYPE = np.dtype([("code", "<i4"), ("onset", "<f8"), ("dur", "<f8")])
+INDEX_DTYPE = np.dtype([("seed", "<i8"), ("offset", "<i8"), ("count", "<i8")])
+# .npy header is always this long so the shape can be rewritten in place
+HEADER_BYTES = 128
+STORE_FILES = {"events": "events.npy", "index": "index.npy", "names": "names.txt"}
+
+
+def npy_header(dtype: np.dtype, nrow: int) -> bytes:
+    """
+    version 1.0 .npy header for a 1d array of nrow, padded to HEADER_BYTES
+    """
+    head = repr({"descr": np.lib.format.dtype_to_descr(dtype),
+                 "fortran_order": False,
+                 "shape": (nrow,)}).encode("latin1")
+    # magic(6) + version(2) + header length(2) + dict + padding + newline
+    pad = HEADER_BYTES - 10 - len(head) - 1
+    if pad < 0:
+        raise ValueError(f"npy header for {dtype} does not fit in {HEADER_BYTES} bytes")
+    return (b"\x93NUMPY\x01\x00" + struct.pack("<H", HEADER_BYTES - 10)
+            + head + b" " * pad + b"\n")
+
+
+class AppendNpy:
+    """
+    1d .npy file that grows with each append. shape is correct after close()
+    """
+
+    def __init__(self, path: os.PathLike, dtype: np.dtype):
+        self.dtype = dtype
+        self.nrow = 0
+        self.fh = open(path, "wb")
+        self.fh.write(npy_header(dtype, 0))
+
+    def append(self, rows: np.ndarray) -> None:
+        data = np.ascontiguousarray(rows, dtype=self.dtype).tobytes()
+        self.fh.write(data)
+        self.nrow += len(rows)
+        count("bytes_written", len(data))
+
+    def close(self) -> None:
+        if self.fh.closed:
+            return
+        self.fh.seek(0)
+        self.fh.write(npy_header(self.dtype, self.nrow))
+        self.fh.close()
+
+
+class StoreWriter:
+    """
+    append iterations (seed + event dataframe) to a store directory.
+    use as a context manager so headers and names are written on the way out
+    """
+
+    def __init__(self, path: os.PathLike):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.events = AppendNpy(os.path.join(path, STORE_FILES["events"]), EVENT_DTYPE)
+        self.index = AppendNpy(os.path.join(path, STORE_FILES["index"]), INDEX_DTYPE)
+        self.codes: dict[str, int] = {}
+
+    def append(self, seed: int, event_df: pd.DataFrame) -> None:
+        """
+        @param event_df  dataframe with row per event. cols: event, onset, dur
+        """
+        rows = np.empty(len(event_df), dtype=EVENT_DTYPE)
+        rows["code"] = [self.codes.setdefault(e, len(self.codes)) for e in event_df["event"]]
+        rows["onset"] = event_df["onset"]
+        rows["dur"] = event_df["dur"]
+        self.index.append(np.array([(seed, self.events.nrow, len(rows))], dtype=INDEX_DTYPE))
+        self.events.append(rows)
+
+    def append_drawn(self, drawn: tuple[int, pd.DataFrame] | None) -> int | None:
+        """
+        append draw_event_df's (seed, event dataframe). like write_drawn
+        @return seed or None if nothing was drawn
+        """
+        if drawn is None:
+            return None
+        with stage("store"):
+            self.append(*drawn)
+        return drawn[0]
+
+    def append_store(self, store: EventStore, seeds=None) -> None:
+        """
+        copy iterations from another store, remapping its event codes.
+        codes are given in order of first appearance, as append would
+        @param seeds  which iterations, in this order. None for all (in store order)
+        """
+        if seeds is None:
+            self.append_rows(store.names, np.array(store.events), np.array(store.index))
+            return
+        where = {s: i for i, s in enumerate(store.seeds.tolist())}
+        for seed in seeds:
+            index = np.array(store.index[where[seed]:where[seed] + 1])
+            (offset, n) = (int(index["offset"][0]), int(index["count"][0]))
+            self.append_rows(store.names, np.array(store.events[offset:offset + n]), index)
+
+    def append_rows(self, names: np.ndarray, rows: np.ndarray, index: np.ndarray) -> None:
+        """
+        @param names  event name for each code in rows
+        @param rows   EVENT_DTYPE rows (changed in place)
+        @param index  INDEX_DTYPE rows for them. first offset is rows[0] (changed in place)
+        """
+        (used, first) = np.unique(rows["code"], return_index=True)
+        for code in used[np.argsort(first)]:
+            self.codes.setdefault(names[code], len(self.codes))
+        lookup = np.array([self.codes.get(name, -1) for name in names], dtype=np.int32)
+        rows["code"] = lookup[rows["code"]]
+        if len(index):
+            index["offset"] += self.events.nrow - index["offset"][0]
+        self.index.append(index)
+        self.events.append(rows)
+
+    def close(self) -> None:
+        self.events.close()
+        self.index.close()
+        with open(os.path.join(self.path, STORE_FILES["names"]), "w") as fh:
+            fh.write("".join(name + "\n" for name in self.codes))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventStore:
+    """
+    read side of a store. arrays are memory mapped, nothing is read until used
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        self.events = np.load(os.path.join(path, STORE_FILES["events"]), mmap_mode="r")
+        self.index = np.load(os.path.join(path, STORE_FILES["index"]), mmap_mode="r")
+        with open(os.path.join(path, STORE_FILES["names"])) as fh:
+            self.names = np.array(fh.read().splitlines(), dtype=object)
+
+    @property
+    def seeds(self) -> np.ndarray:
+        return np.asarray(self.index["seed"])
+
+    @functools.cached_property
+    def rows(self) -> dict[int, int]:
+        "seed -> its row in index (the first, if a seed is there twice). built on first use"
+        rows: dict[int, int] = {}
+        for (i, seed) in enumerate(self.seeds.tolist()):
+            rows.setdefault(seed, i)
+        return rows
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def event_df(self, seed: int) -> pd.DataFrame:
+        """
+        @return dataframe like triallist_to_df made for seed. cols: event, onset, dur
+        """
+        if seed not in self.rows:
+            raise KeyError(f"seed {seed} is not in store {self.path}")
+        import pandas as pd
+        (_, offset, count) = self.index[self.rows[seed]]
+        rows = self.events[offset:offset + count]
+        return pd.DataFrame({"event": self.names[rows["code"]],
+                             "onset": np.asarray(rows["onset"]),
+                             "dur": np.asarray(rows["dur"])})
+
+
+def export_store(path: os.PathLike, seeds=None, outdir: os.PathLike = ".") -> list[int]:
+    """
+    write seeds from the store at path as '%018d' folders
+    (event_onset_duration.tsv and 1D files) like write_trials does without a store
+    @param seeds  which iterations. None for all
+    @return seeds written
+    """
+    store = EventStore(path)
+    if seeds is None:
+        seeds = store.seeds.tolist()
+    for seed in seeds:
+        write_event_df(store.event_df(seed), os.path.join(outdir, "%018d" % seed))
+    return list(seeds)
@@ -0,0 +1,80 @@
+"""
+Write iterations on background threads while the next ones are drawn.
+
+  with BackgroundWriter(nthreads=2) as bg:
+      for drawn in iterations:
+          bg.put(write_drawn, drawn)
+
+put() hands a call to writer threads through a queue of at most maxsize
+pending calls (blocks when full, so at most that many iterations wait in memory).
+Leaving the with block writes everything still queued, also when leaving
+on an error. An error in a write stops the remaining writes and is raised
+in the generating thread on the next put() or on close.
+With nthreads=0 calls run right away in put().
+"""
+import queue
+import threading
+from .instrument import stage
+
+# pending writes per writer thread
+QUEUE_PER_THREAD = 8
+
+
+class BackgroundWriter:
+    """
+    @param nthreads  writer threads. 0 to write in put(). order is kept with 1
+    @param maxsize   most queued calls (default QUEUE_PER_THREAD per thread)
+    """
+
+    def __init__(self, nthreads=1, maxsize: int | None = None):
+        self.error: BaseException | None = None
+        self.failed = False
+        self.queue: queue.Queue = queue.Queue(maxsize or QUEUE_PER_THREAD * max(nthreads, 1))
+        self.threads = [threading.Thread(target=self._run, name="gtt-writer-%d" % i, daemon=True)
+                        for i in range(nthreads)]
+        for t in self.threads:
+            t.start()
+
+    def _run(self) -> None:
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            if self.failed:
+                continue
+            (func, args) = task
+            try:
+                func(*args)
+            except BaseException as err:
+                self.failed = True
+                self.error = err
+
+    def _raise(self) -> None:
+        "raise a writer thread's error (once)"
+        if self.error is not None:
+            (err, self.error) = (self.error, None)
+            raise err
+
+    def put(self, func, *args) -> None:
+        "func(*args) on a writer thread. waits while the queue is full"
+        self._raise()
+        if not self.threads:
+            func(*args)
+            return
+        with stage("write_wait"):
+            self.queue.put((func, args))
+
+    def close(self) -> None:
+        "finish every queued write, stop the threads, raise any write error"
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+badmath against the original (loop/recursive) implementations, copied below.
+random cases from fixed seeds (like hypothesis would, without the dependency)
+"""
+import functools
+import random
+import time
+import pytest
+from genTaskTime.badmath import fit_dist, zeno_dichotomy, rep_a_b_times
+
+
+# ## originals
+def legacy_fit_dist(nelm, freq, nsamples):
+    nsamples_in_freq = sum(freq)
+    while nelm < len(freq):
+        lastf = freq.pop()
+        idx = len(freq) - 1
+        cmpval = 9e9
+        if idx > 0:
+            cmpval = freq[idx-1]
+        while idx > 0 and freq[idx] >= cmpval:
+            idx -= 1
+            cmpval = freq[idx-1]
+        freq[idx] += lastf
+    i = 0
+    while nelm > len(freq):
+        freq[i] -= 1
+        freq.append(1)
+        i = (i + 1) % len(freq)
+    i = 0
+    while nsamples_in_freq > nsamples:
+        while freq[i] == 1 and nsamples_in_freq <= len(freq):
+            i = (i + 1) % len(freq)
+        freq[i] -= 1
+        i = (i + 1) % len(freq)
+        nsamples_in_freq = sum(freq)
+    while nsamples_in_freq < nsamples:
+        freq[i] += 1
+        i = (i + 1) % len(freq)
+        nsamples_in_freq = sum(freq)
+    return(freq)
+
+
+def legacy_zeno_dichotomy(n):
+    n = int(n)
+    if n <= 1:
+        return([1])
+    else:
+        n = int(n/2)
+        return [n] + legacy_zeno_dichotomy(n)
+
+
+def legacy_rep_a_b_times(a, b):
+    listoflist = [[a[i]]*int(b[i]) for i in range(len(a))]
+    return functools.reduce(lambda x, y: x + y, listoflist)
+
+
+# ## properties
+@pytest.mark.parametrize("seed", range(300))
+def test_fit_dist_same(seed):
+    """ same frequencies as before. nsamples >= nelm (else the original can loop forever) """
+    rand = random.Random(seed)
+    nelm = rand.randint(1, 12)
+    if rand.random() < .5:
+        freq = zeno_dichotomy(rand.randint(1, 5000))
+    else:
+        freq = [rand.randint(1, 60) for _ in range(rand.randint(1, 15))]
+    nsamples = rand.randint(nelm, 3 * sum(freq) + nelm)
+    expect = legacy_fit_dist(nelm, list(freq), nsamples)
+    got = fit_dist(nelm, list(freq), nsamples)
+    assert got == expect
+    assert len(got) == nelm
+    assert sum(got) == nsamples
+
+
+def test_fit_dist_no_mutate():
+    freq = [4, 2, 1, 1]
+    fit_dist(2, freq, 20)
+    assert freq == [4, 2, 1, 1]
+
+
+@pytest.mark.parametrize("n", list(range(0, 70)) + [1000, 1023, 1024, 10**6 + 7])
+def test_zeno_same(n):
+    assert zeno_dichotomy(n) == legacy_zeno_dichotomy(n)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_rep_a_b_same(seed):
+    rand = random.Random(seed)
+    n = rand.randint(1, 10)
+    a = [rand.choice([1, 2, 1.5, 4.25]) for _ in range(n)]
+    b = [rand.randint(0, 20) for _ in range(n)]
+    assert rep_a_b_times(a, b) == legacy_rep_a_b_times(a, b)
+
+
+def test_fit_dist_big():
+    """ 10^6 samples does not stall """
+    start = time.perf_counter()
+    f = fit_dist(7, zeno_dichotomy(10**6), 10**6)
+    assert sum(f) == 10**6
+    f = fit_dist(40, [10**5] * 40, 400)
+    assert f == [10] * 40
+    assert time.perf_counter() - start < 1
@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
 import genTaskTime as gtt
+import json
+import os
+import subprocess
+import sys
+import pytest
 
 
 def test_cli_show(tmpdir):
@@ -7,8 +12,423 @@ def test_cli_show(tmpdir):
     gtt.main('-n', '<10/1> cue=[1]')
 
 
+def imported_after(*args) -> set[str]:
+    "heavy modules imported by running genTaskTime with args (in a fresh python)"
+    code = ("import sys, genTaskTime\n"
+            "try:\n    genTaskTime.main(*sys.argv[1:])\n"
+            "except SystemExit:\n    pass\n"
+            "print(' '.join(m for m in ('pandas', 'numpy', 'tatsu', 'anytree')"
+            " if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", code, *args], capture_output=True,
+                         text=True, check=True, cwd=root)
+    return set(out.stdout.splitlines()[-1].split())
+
+
+def test_startup_imports():
+    """ -h imports nothing heavy. -n (dry run) never needs pandas """
+    assert imported_after('-h') == set()
+    assert 'pandas' not in imported_after('-n', '<10/1> cue=[1](A,B)')
+
+
+def test_lazy_names():
+    assert gtt.EventNode.__name__ == 'EventNode'
+    assert gtt.FittedDesign.__name__ == 'FittedDesign'
+    assert callable(gtt.parse) and callable(gtt.rep_a_b_times)
+    with pytest.raises(AttributeError):
+        gtt.not_a_name
+
+
 def test_cli(tmpdir):
     tmpdir.chdir()
     gtt.main('-o', 'stims', '-i', '2', '<10/1> cue=[1]')
     iters = tmpdir.join('stims').listdir()
     assert len(iters) == 2
+
+
+def test_cli_jobs(tmpdir):
+    """ same base seed, same iterations. regardless of number of processes """
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); dly=[1,2]; end=[1]'
+    gtt.main('-o', 'j1', '-i', '6', '--seed', '42', '-v', '0', desc)
+    tmpdir.chdir()
+    gtt.main('-o', 'j3', '-i', '6', '--seed', '42', '-v', '0', '-j', '3', desc)
+    j1 = sorted(x.basename for x in tmpdir.join('j1').listdir())
+    j3 = sorted(x.basename for x in tmpdir.join('j3').listdir())
+    assert len(j1) == 6
+    assert j1 == j3
+    tsv = 'event_onset_duration.tsv'
+    assert tmpdir.join('j1', j1[0], tsv).read() == \
+        tmpdir.join('j3', j1[0], tsv).read()
+
+
+def test_cli_keep_best(tmpdir):
+    """ scores every seed, writes only the best K. best match scores.tsv """
+    tmpdir.chdir()
+    desc = '<60/6 @2 glt:d=cue_A-cue_B> cue=[1](A,B); dly=[1,2]; end=[1]'
+    gtt.main('-o', 'best', '-i', '20', '--seed', '7', '-v', '0',
+             '--keep-best', '3', '--metric', 'd', desc)
+    out = tmpdir.join('best')
+    dirs = sorted(x.basename for x in out.listdir() if x.isdir())
+    assert len(dirs) == 3
+
+    lines = out.join('scores.tsv').read().splitlines()
+    header = lines[0].split('\t')
+    assert header[:2] == ['seed', 'score']
+    assert 'd' in header
+    rows = [l.split('\t') for l in lines[1:]]
+    assert len(rows) == 20
+    assert all(float(r[1]) == float(r[header.index('d')]) for r in rows)
+    top = sorted(rows, key=lambda r: -float(r[1]))[:3]
+    assert sorted(r[0] for r in top) == dirs
+    assert out.join(dirs[0], 'event_onset_duration.tsv').check()
+
+    # same winners from more processes
+    tmpdir.chdir()
+    gtt.main('-o', 'best_j2', '-i', '20', '--seed', '7', '-v', '0',
+             '--keep-best', '3', '--metric', 'd', '-j', '2', desc)
+    dirs_j2 = sorted(x.basename for x in tmpdir.join('best_j2').listdir() if x.isdir())
+    assert dirs_j2 == dirs
+
+
+def test_cli_store(tmpdir):
+    """ store + export is the same as writing folders directly """
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); dly=[1,2]; end=[1]'
+    gtt.main('-o', 'dirs', '-i', '5', '--seed', '3', '-v', '0', desc)
+    tmpdir.chdir()
+    gtt.main('-o', 'store', '-i', '5', '--seed', '3', '-v', '0', '--store', desc)
+    assert sorted(x.basename for x in tmpdir.join('store').listdir()) == \
+        ['events.npy', 'index.npy', 'names.txt']
+
+    store = gtt.EventStore(str(tmpdir.join('store')))
+    dirs = sorted(x.basename for x in tmpdir.join('dirs').listdir())
+    assert sorted('%018d' % s for s in store.seeds) == dirs
+
+    gtt.main('export', str(tmpdir.join('store')), '-o', str(tmpdir.join('out')),
+             str(store.seeds[0]))
+    seed = '%018d' % store.seeds[0]
+    assert [x.basename for x in tmpdir.join('out').listdir()] == [seed]
+    for f in tmpdir.join('dirs', seed).listdir():
+        assert tmpdir.join('out', seed, f.basename).read() == f.read()
+    # seeds are looked up by row
+    assert [store.rows[s] for s in store.seeds.tolist()] == list(range(5))
+    with pytest.raises(KeyError):
+        store.event_df(1)
+
+
+def test_iter_designs(tmpdir):
+    """ same iterations as written by main, without writing anything """
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); dly=[1,2]; end=[1]'
+    designs = list(gtt.iter_designs(desc, 4, seed=9))
+    assert tmpdir.listdir() == []
+    assert len(designs) == 4
+
+    gtt.main('-o', 'dirs', '-i', '4', '--seed', '9', '-v', '0', desc)
+    dirs = sorted(x.basename for x in tmpdir.join('dirs').listdir())
+    assert sorted('%018d' % d.seed for d in designs) == dirs
+
+    d = designs[0]
+    tsv = tmpdir.join('dirs', '%018d' % d.seed, 'event_onset_duration.tsv')
+    assert d.event_df().to_csv(sep='\t', index=False, float_format='%.3f') == tsv.read()
+    assert sum(d.itis) == pytest.approx(d.dur[d.event == '__iti__'].sum())
+    assert len(d.event) == len(d.onset) == len(d.dur)
+
+    # stop early
+    first = next(gtt.iter_designs(desc, 1000, seed=9))
+    assert first.seed == designs[0].seed
+
+
+def test_cli_profile(tmpdir, capsys):
+    """ stage times and counters, also from worker processes """
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); dly=[1,2]; end=[1]'
+    gtt.main('-o', 'prof', '-i', '6', '-v', '0', '-j', '2', '--profile', 'prof.json', desc)
+    assert 'write_trials' in capsys.readouterr().out
+    prof = json.loads(tmpdir.join('prof.json').read())
+    assert prof['counters']['iterations'] == 6
+    assert prof['counters']['shuffle_attempts'] == 6
+    assert prof['calls']['shuffle'] == 6
+    assert prof['calls']['write_1D'] == 6
+    # tsv + cue_A, cue_B, dly, end
+    assert prof['counters']['files_written'] == 6 * 5
+    assert prof['counters']['bytes_written'] > 0
+    # off again afterwards
+    assert not gtt.instrument.PROFILE.enabled
+
+
+def test_profile_merge_threads():
+    """ merging worker snapshots while writer threads count loses nothing """
+    import threading
+    from genTaskTime.instrument import Profile
+    prof = Profile()
+
+    def writes():
+        for _ in range(20000):
+            prof.add_time('write', 0.0)
+    threads = [threading.Thread(target=writes) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for _ in range(20000):
+        prof.merge({'seconds': {'write': 0.0}, 'calls': {'write': 1}, 'counters': {}})
+    for t in threads:
+        t.join()
+    assert prof.calls['write'] == 60000
+
+
+def test_cli_cache_dir(tmpdir, capsys):
+    """ cached design writes the same iterations. bad entries are rebuilt """
+    from genTaskTime.cache import cache_path
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); dly=[1,2]; end=[1]'
+    gtt.main('-o', 'plain', '-i', '3', '--seed', '2', '-v', '0', desc)
+    tmpdir.chdir()
+    for out in ('c1', 'c2'):
+        gtt.main('-o', out, '-i', '3', '--seed', '2', '-v', '0', '--cache-dir', 'cache', desc)
+        tmpdir.chdir()
+    entry = tmpdir.join('cache').listdir()
+    assert [x.basename for x in entry] == [os.path.basename(cache_path('.', desc))]
+    # whitespace does not matter
+    assert cache_path('.', desc) == cache_path('.', '  ' + desc.replace('; ', ';  '))
+    for out in ('c1', 'c2'):
+        for d in tmpdir.join('plain').listdir():
+            tsv = d.join('event_onset_duration.tsv')
+            assert tmpdir.join(out, d.basename, tsv.basename).read() == tsv.read()
+
+    capsys.readouterr()
+    raw = entry[0].read_binary()
+    entry[0].write_binary(raw[:-10] + b'0' * 10)
+    gtt.main('-o', 'c3', '-i', '3', '--seed', '2', '-v', '0', '--cache-dir', 'cache', desc)
+    tmpdir.chdir()
+    assert 'corrupt. rebuilding' in capsys.readouterr().out
+    assert entry[0].read_binary() == raw
+    assert sorted(x.basename for x in tmpdir.join('c3').listdir()) == \
+        sorted(x.basename for x in tmpdir.join('plain').listdir())
+
+
+def test_cache_stale(tmpdir, monkeypatch, capsys):
+    from genTaskTime import cache
+    desc = '<30/4> cue=[1](A,B); end=[1]'
+    design = cache.cached_design(desc, str(tmpdir), verb=0)
+    path = cache.cache_path(str(tmpdir), desc)
+    assert cache.read_entry(path, desc).nperms == design.nperms
+    # same file read for another version
+    monkeypatch.setattr(gtt, '__version__', 'x')
+    assert cache.read_entry(path, desc) is None
+    assert 'stale' in capsys.readouterr().out
+    # new version, new key
+    assert cache.cache_path(str(tmpdir), desc) != path
+
+
+def test_cli_resume(tmpdir, monkeypatch, capsys):
+    """ killed run picks up where it stopped: same seeds and files as one full run """
+    from genTaskTime import generate
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); dly=[1,2]; end=[1]'
+    gtt.main('-o', 'full', '-i', '8', '--seed', '5', '-v', '0', desc)
+    tmpdir.chdir()
+
+    # die after 3 iterations (on the writer thread). manifest still gets what finished.
+    # one writer: with more, which 3 finish first is up to the threads
+    write_drawn = generate.write_drawn
+    calls = []
+
+    def dies(drawn):
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        calls.append(drawn)
+        return write_drawn(drawn)
+    monkeypatch.setattr(generate, 'write_drawn', dies)
+    with pytest.raises(KeyboardInterrupt):
+        gtt.main('-o', 'run', '-i', '8', '--seed', '5', '-v', '0', '--resume',
+                 '--writers', '1', desc)
+    tmpdir.chdir()
+    manifest = tmpdir.join('run', 'manifest.tsv')
+    lines = manifest.read().splitlines()
+    assert lines[0] == '# genTaskTime manifest base_seed 5'
+    assert [int(x.split()[0]) for x in lines[1:]] == [0, 1, 2]
+    # and a line cut off mid write
+    manifest.write('3\t12', mode='a')
+
+    monkeypatch.setattr(generate, 'write_drawn', write_drawn)
+    capsys.readouterr()
+    # base seed from the manifest
+    gtt.main('-o', 'run', '-i', '8', '-v', '1', '--resume', desc)
+    tmpdir.chdir()
+    assert 'resuming: 3 of 8' in capsys.readouterr().out
+    done = [x.split() for x in manifest.read().splitlines()[1:]]
+    assert sorted(int(d[0]) for d in done if len(d) == 3) == list(range(8))
+    full = sorted(x.basename for x in tmpdir.join('full').listdir())
+    assert sorted(x.basename for x in tmpdir.join('run').listdir()) == full + ['manifest.tsv']
+    for d in full:
+        tsv = 'event_onset_duration.tsv'
+        assert tmpdir.join('run', d, tsv).read() == tmpdir.join('full', d, tsv).read()
+
+    with pytest.raises(SystemExit):
+        gtt.main('-o', 'run', '-i', '8', '--seed', '6', '-v', '0', '--resume', desc)
+    assert 'was made with --seed 5' in capsys.readouterr().out
+
+
+def dir_files(d) -> dict:
+    "relative path -> bytes of every file under d"
+    return {f.relto(d): f.read_binary() for f in d.visit() if f.isfile()}
+
+
+@pytest.mark.parametrize("mode", [[], ['--store'], ['--keep-best', '4'],
+                                  ['--keep-best', '4', '--store']])
+def test_cli_shard_merge(tmpdir, mode):
+    """ shards merged are the same as one run: folders, store, best K, scores.tsv """
+    tmpdir.chdir()
+    desc = '<60/6 @2 glt:d=cue_A-cue_B> cue=[1](A,B); dly=[1,2]; end=[1]'
+    run = ['-i', '300', '--seed', '11', '-v', '0'] + mode
+    gtt.main('-o', 'single', *run, desc)
+    shards = []
+    # out of order. 300 iterations are 3 blocks of 128: shard 0 (of 4) is empty
+    for i in (3, 0, 2, 1):
+        tmpdir.chdir()
+        gtt.main('-o', 's%d' % i, '--shard', '%d/4' % i, *run, desc)
+        shards.append(str(tmpdir.join('s%d' % i)))
+    tmpdir.chdir()
+    gtt.main('merge', *shards, '-o', 'merged')
+
+    single = dir_files(tmpdir.join('single'))
+    assert single
+    assert dir_files(tmpdir.join('merged')) == single
+
+
+def test_cli_shard_errors(tmpdir, capsys):
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); end=[1]'
+    with pytest.raises(SystemExit):
+        gtt.main('-o', 'x', '--shard', '0/2', '-i', '2', desc)
+    assert 'needs --seed' in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        gtt.main('-o', 'x', '--shard', '2/2', '--seed', '1', '-i', '2', desc)
+    assert '0 <= i < N' in capsys.readouterr().out
+
+    tmpdir.chdir()
+    gtt.main('-o', 's0', '--shard', '0/2', '--seed', '1', '-i', '2', '-v', '0', desc)
+    tmpdir.chdir()
+    with pytest.raises(SystemExit):
+        gtt.main('merge', 's0', '-o', 'merged')
+    assert 'need each of 2 shards once' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("writers", ['0', '3'])
+def test_cli_writers(tmpdir, writers):
+    """ same files with any number of writer threads """
+    tmpdir.chdir()
+    desc = '<30/4> cue=[1](A,B); dly=[1,2]; end=[1]'
+    gtt.main('-o', 'one', '-i', '40', '--seed', '8', '-v', '0', desc)
+    tmpdir.chdir()
+    gtt.main('-o', 'w', '-i', '40', '--seed', '8', '-v', '0', '--writers', writers, desc)
+    assert len(tmpdir.join('one').listdir()) == 40
+    assert dir_files(tmpdir.join('w')) == dir_files(tmpdir.join('one'))
+
+
+def test_background_writer():
+    """ queue is bounded, everything queued is written on close, errors come back """
+    import threading
+    from genTaskTime.writer import BackgroundWriter
+    (running, gate) = (threading.Event(), threading.Event())
+    out = []
+
+    def slow(x):
+        running.set()
+        gate.wait()
+        out.append(x)
+    bg = BackgroundWriter(1, maxsize=2)
+    bg.put(slow, 0)
+    running.wait()
+    bg.put(slow, 1)
+    bg.put(slow, 2)
+    # one running, two queued
+    assert bg.queue.full()
+    gate.set()
+    bg.close()
+    assert out == [0, 1, 2]
+
+    def bad(x):
+        if x == 1:
+            raise OSError("disk full")
+        out.append(x)
+    out.clear()
+    with pytest.raises(OSError):
+        with BackgroundWriter(1) as bg:
+            for i in range(4):
+                bg.put(bad, i)
+    assert out == [0]
+
+
+def test_cli_precheck(tmpdir, capsys):
+    """ hopeless designs stop before any iteration (or output directory) is made """
+    tmpdir.chdir()
+    # 12 of iti to fill, maxiti 2 allows at most 4*1 + 2 (first gap)
+    desc = '<30/4 iti:1-2> cue=[1](A,B); dly=[1,2]; end=[1]'
+    with pytest.raises(SystemExit):
+        gtt.main('-o', 'x', '-i', '5', desc)
+    out = capsys.readouterr().out
+    assert 'ERROR: longest task time (18.00) leaves 12.00 of iti' in out
+    assert 'try rundur between 18.00 and 24.00' in out
+    assert 'try iti:1-3.2' in out
+    assert not tmpdir.join('x').exists()
+
+    with pytest.raises(SystemExit):
+        gtt.main('-n', '<12/4 iti:1-4> cue=[1](A,B); dly=[1,2]; end=[1]')
+    assert 'shortest task time (18.00) is longer than the run (12.00)' in capsys.readouterr().out
+
+    gtt.main('-n', '<30/4 iti:1-4> cue=[1](A,B); dly=[1,2]; end=[1]')
+    out = capsys.readouterr().out
+    assert 'min 18.00, expected 18.00 (sd 0.00), max 18.00' in out
+    assert 'ERROR' not in out
+
+
+def test_feasibility_ranges():
+    """ task time range and spread match drawn iterations """
+    import numpy as np
+    from genTaskTime.feasibility import check_feasible, p_gaps_within
+    (last_leaves, settings) = gtt.str_to_last_leaves(
+        '<300/40 iti:1-5> cue=[1](A,B,C,D); dly=[1,2,3]; end=[1]', 0)
+    design = gtt.FittedDesign(last_leaves, settings, 0)
+    feas = check_feasible(design)
+    # dly is 13 copies of [1,2,3] and one picked at random each iteration
+    assert (feas.task_min, feas.task_mean, feas.task_max) == (199, 200, 201)
+    totals = []
+    for i in range(300):
+        rng = np.random.default_rng(i)
+        for u in design.unique_nodes:
+            u.draw_dur(rng)
+        totals.append(design.template.fill().trial_durs().sum())
+    assert feas.task_min <= min(totals) and max(totals) <= feas.task_max
+    assert abs(np.std(totals) - feas.task_sd) < .2 * feas.task_sd
+    assert feas.p_fit == 1 and not feas.errors
+
+    # against counting every gap vector
+    for (nslots, ntrial, maxslots, maxfirst) in [(7, 3, 2, 3), (9, 4, 1, 9), (6, 3, 2, None)]:
+        ngaps = ntrial + (maxfirst is not None)
+        gaps = [v for v in np.ndindex(*[nslots + 1] * ngaps) if sum(v) == nslots]
+        ok = [v for v in gaps if (maxfirst is None or v[0] <= maxfirst) and
+              max(v[maxfirst is not None:]) <= maxslots]
+        assert p_gaps_within(nslots, ntrial, maxslots, maxfirst) == pytest.approx(len(ok) / len(gaps))
+
+
+def test_feasibility_fast(monkeypatch):
+    """ thousands of trials are checked in milliseconds. approximation is close to exact """
+    import time
+    from genTaskTime import feasibility
+    (last_leaves, settings) = gtt.str_to_last_leaves('<3600/5000 iti:0.2-1.2> cue=[0.3](A,B)', 0)
+    design = gtt.FittedDesign(last_leaves, settings, 0)
+    start = time.perf_counter()
+    feas = feasibility.check_feasible(design)
+    assert time.perf_counter() - start < .2
+    assert 0 < feas.p_maxiti < 1e-20
+    start = time.perf_counter()
+    assert 0 < feasibility.p_gaps_within(360000, 8000, 300, 320) < 1
+    assert time.perf_counter() - start < .2
+
+    for args in [(1000, 50, 30, 40), (5000, 200, 30, None), (20000, 400, 60, 80)]:
+        exact = feasibility.p_gaps_within(*args)
+        monkeypatch.setattr(feasibility, 'EXACT_COST', 0)
+        assert feasibility.p_gaps_within(*args) == pytest.approx(exact, rel=.01)
+        monkeypatch.undo()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import genTaskTime as gtt
 from helpers import dummydur, cnt
+import numpy as np
 
 
 def test_parse_dur():
@@ -73,3 +74,44 @@ def test_dur_list():
 
     # and nothing else
     assert all([x in [1, 2, 4] for x in durs])
+
+
+def test_draw_dur_rng():
+    """ pool is fit once. each draw is a permutation of it (+ random extras) """
+    dur = {'dist': 'u', 'dur': None, 'min': None, 'max': None,
+           'steps': [{'freq': None, 'num': 1},
+                     {'freq': None, 'num': 2},
+                     {'freq': None, 'num': 4}]}
+    node = gtt.EventNode('test', dur, nrep=5)
+    node.count_reps()
+    node.master_total_reps = 5
+    node.fit_dur(1)
+    assert node.dur_extra == 2  # 5 samples from 3 values: 1 full set + 2
+    d1 = node.draw_dur(np.random.default_rng(1))
+    d2 = node.draw_dur(np.random.default_rng(1))
+    assert list(d1) == list(d2)
+    assert len(d1) == 5
+    assert set([1.0, 2.0, 4.0]) <= set(d1.tolist())
+    # next_dur reads forward from the cursor
+    assert [node.next_dur() for _ in range(5)] == d2.tolist()
+    assert node.next_dur() == 0
+
+
+def test_draw_dur_random_seed():
+    """ without a generator, draws follow random.seed (like before numpy pools).
+    FittedDesign only fits: nothing is drawn until draw(seed) """
+    import random
+    desc = '<60/12> cue=[1](A,B); dly=[1,2,4]; end=[1]'
+    random.seed(3)
+    (tl1, _) = gtt.str_to_triallist(desc, 0)
+    random.seed(3)
+    (tl2, _) = gtt.str_to_triallist(desc, 0)
+    assert tl1 == tl2
+
+    (last_leaves, settings) = gtt.str_to_last_leaves(desc)
+    design = gtt.FittedDesign(last_leaves, settings, 0)
+    assert not any(hasattr(u, 'dur_dist') for u in design.unique_nodes)
+    random.seed(3)
+    t1 = design.triallist().to_triallist()
+    random.seed(3)
+    assert design.triallist().to_triallist() == t1
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import genTaskTime as gtt
+from genTaskTime.efficiency import Efficiency, gam, block, block_peak, glt_contrast, response
+from genTaskTime.TrialList import triallist_to_df
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_hrf():
+    # AFNI GAM peaks at 1 at p*q
+    assert gam(np.array([8.6 * .547]))[0] == pytest.approx(1)
+    assert gam(np.array([-1, 0]))[0] == 0
+    # long BLOCK4 plateaus at integral of g. normalized BLOCK peaks at 1
+    assert block(np.array([50.]), 100)[0] == pytest.approx(24 / (4**4 * np.exp(-4)))
+    assert block_peak([1, 50])[1] == pytest.approx(block(np.array([50.]), 100)[0])
+    t = np.arange(0, 30, .1)
+    assert response('BLOCK', t, np.array(2.)).max() == pytest.approx(1, abs=1e-3)
+    with pytest.raises(ValueError):
+        response('TENT', t, 1)
+
+
+def test_glt_contrast():
+    labels = ['A', 'B', 'cue_1']
+    assert list(glt_contrast('A-B', labels)) == [1, -1, 0]
+    assert list(glt_contrast('.5*A + .5 * cue_1', labels)) == [.5, 0, .5]
+    with pytest.raises(ValueError):
+        glt_contrast('A-C', labels)
+
+
+def test_efficiency():
+    s = "<300/20 @2 glt:d=cue_A-cue_B> cue=[1.5](A,B)@GAM; end=[1.5]"
+    (last_leaves, settings) = gtt.str_to_last_leaves(s, verb=0)
+    design = gtt.FittedDesign(last_leaves, settings, verb=0)
+    eff = Efficiency(last_leaves, settings)
+    # first seen walking the leaves
+    assert eff.labels == ['cue_A', 'end', 'cue_B']
+    assert eff.models == ['GAM', 'dmBLOCK', 'GAM']
+    # parent glt (cue) and settings glt (d)
+    assert eff.contrast_labels == ['cue_A', 'end', 'cue_B', 'cue', 'd']
+
+    (tl, seed) = design.draw(1)
+    edf = triallist_to_df(tl, 0)
+    X = eff.design_matrix(edf)
+    # polort 1 + 300//150 == 3: 4 drift + 3 stims
+    assert X.shape == (150, 4 + 3)
+    effs = eff.efficiency(edf)
+    assert all(v > 0 for v in effs.values())
+
+
+def test_efficiency_single():
+    """ 1/var of the stim beta. missing stim cannot be estimated """
+    s = "<300/10 @1> cue=[1](A,B)"
+    (last_leaves, settings) = gtt.str_to_last_leaves(s, verb=0)
+    eff = Efficiency(last_leaves, settings, polort=0)
+    edf = pd.DataFrame({'event': ['cue_A'] * 10, 'dur': [1] * 10,
+                        'onset': np.arange(10) * 29.})
+    effs = eff.efficiency(edf)
+    assert effs['cue_B'] == 0
+
+    X = np.column_stack([np.ones(300),
+                         eff.regressor('dmBLOCK', edf['onset'], edf['dur'])])
+    expect = 1 / np.linalg.inv(X.T @ X)[1, 1]
+    X1 = eff.design_matrix(edf)
+    assert X1.shape == (300, 3)
+    assert np.allclose(X1[:, 0:2], X)
+    effs = Efficiency(last_leaves, settings, polort=0).efficiency(
+        edf.assign(event=['cue_A', 'cue_B'] * 5))
+    assert effs['cue_A'] > 0
+    assert effs['cue_A'] < expect
+
+
+def test_efficiency_needs_tr():
+    (last_leaves, settings) = gtt.str_to_last_leaves("<30/1> cue=[1]", verb=0)
+    with pytest.raises(ValueError):
+        Efficiency(last_leaves, settings)
+
+
+def test_batch_efficiency():
+    s = "<120/8 @1.5 glt:d=cue_A-cue_B> cue=[1](A,B)@BLOCK; dly=[1,2]; end=[1]@GAM"
+    (last_leaves, settings) = gtt.str_to_last_leaves(s, verb=0)
+    design = gtt.FittedDesign(last_leaves, settings, verb=0)
+    eff = Efficiency(last_leaves, settings)
+    edfs = [triallist_to_df(design.draw(i)[0], 0) for i in range(5)]
+    X = eff.design_matrices(edfs)
+    assert X.shape == (5, 80, 1 + 1 + 4)
+    assert np.allclose(X[2], eff.design_matrix(edfs[2]))
+    single = np.array([list(eff.efficiency(e).values()) for e in edfs])
+    assert np.allclose(eff.batch_efficiency(edfs, chunk=2), single)
+
+    # one candidate without cue_B. cannot estimate it, others still scored
+    edfs[1] = edfs[1][edfs[1]['event'] != 'cue_B']
+    effs = eff.batch_efficiency(edfs)
+    assert effs[1, eff.contrast_labels.index('cue_B')] == 0
+    assert np.allclose(effs[0], single[0])
+
+
+def test_score_metric():
+    (ll, settings) = gtt.str_to_last_leaves("<300/10 @1 glt:d=cue_A-cue_B> cue=[1](A,B)", 0)
+    eff = Efficiency(ll, settings)
+    effs = np.array([[1., 3., 4., 0.], [4., 2., 6., 8.]])
+    assert eff.contrast_labels == ['cue_A', 'cue_B', 'cue', 'd']
+    assert eff.score(effs, 'mean').tolist() == [2., 5.]
+    assert eff.score(effs, 'min').tolist() == [0., 2.]
+    assert eff.score(effs, 'd').tolist() == [0., 8.]
+    with pytest.raises(ValueError):
+        eff.score(effs, 'nope')
@@ -160,3 +160,11 @@ def test_decon_model():
     s = "<10/1 glt:diff=resp-cue> cue=[2]@GAM; resp=[1]"
     events = gtt.parse_events(gtt.parse(s))
     assert events[0]['model'] == 'GAM'
+
+
+def test_parse_cached():
+    a = gtt.parse("<10/1>  cue=[2]; end=[1]")
+    b = gtt.parse(" <10/1> cue=[2];\n end=[1] ")
+    # whitespace normalized: same cached AST
+    assert a is b
+    assert gtt.parse_events(a)[1]['eventname'] == 'end'
@@ -46,6 +46,20 @@ def test_mkChild():
     assert children[0].root == root
 
 
+def test_mkChild_cross():
+    """ factors crossed in order. the (cached) AST is left as is """
+    s = "<60/6> cue=[1](A,B * 2x N,F * X); end=[3]"
+    elist = gtt.parse_events(gtt.parse(s))[0]['eventtypes']
+    before = repr(elist)
+    root = gtt.EventNode('root', dur=0)
+    leaves = mkChild(root, elist, verb=0)
+    assert ["_".join(n.name for n in l.path[1:]) for l in leaves] == \
+        ["A_N_X", "B_N_X", "A_F_X", "B_F_X"]
+    assert [l.parent.nrep for l in leaves] == [2, 2, 1, 1]
+    assert repr(elist) == before
+    assert len(mkChild(gtt.EventNode('root', dur=0), elist, verb=0)) == 4
+
+
 def test_simple_tree():
     s = "<60/6> cue=[1]; end=[3]"
     # parse
@@ -64,3 +64,32 @@ def test_df_to_1D():
     assert onsets_list['A.1D'] == ['5.00:5.00', '10.00:1.00']
     assert onsets_list['B.1D'] == ['11.00:1.00']
     assert onsets_list.get('__iti__.1D') is None
+
+
+def test_df_to_1D_write(tmpdir):
+    edf = pd.DataFrame({'event': ['B', '__iti__', 'A', 'B', 'A'],
+                        'dur':   [  1,         5,   5,   2, 1.5],
+                        'onset': [  0,         1,   6,  11,  13]})
+    savedir = str(tmpdir.join('seed'))
+    onsets_list = df_to_1D(edf, savedir=savedir, writedur=False)
+    # first seen first
+    assert [k.split('/')[-1] for k in onsets_list] == ['B.1D', 'A.1D']
+    assert tmpdir.join('seed', 'A.1D').read() == '6.00 13.00\n'
+    assert tmpdir.join('seed', 'B.1D').read() == '0.00 11.00\n'
+
+
+def test_template_fill():
+    """ compiled templates make the same trials as walking the tree """
+    s = "<80/16> ring=[1.5](rew,neu){.25}; prep=[1,2]; dot=[1.5](left,right)"
+    (last_leaves, settings) = gtt.str_to_last_leaves(s, verb=0)
+    (n_rep, _) = last_leaves.fit_tree(settings['ntrial'])
+    walked = last_leaves.event_tree_to_list(n_rep, settings['miniti'])
+
+    # same draws again
+    for u in last_leaves.unique_nodes:
+        u.dur_cursor = 0
+    template = last_leaves.compile_templates(n_rep, settings['miniti'], settings['granularity'])
+    compiled = template.fill().to_triallist()
+    assert compiled == walked
+    # used durations are skipped, like next_dur
+    assert all(u.dur_cursor == len(u.dur_dist) for u in template.nodes)
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import genTaskTime as gtt
-from genTaskTime.TrialList import shuffle_triallist, iti_list
+from genTaskTime.TrialList import shuffle_triallist, iti_list, gap_vector
+from genTaskTime.TrialArray import TrialArray
 import pprint
 import helpers
 import numpy as np
+import pytest
 
 
 # shuffle was causing issues
@@ -63,3 +65,105 @@ def test_shuffle_seed():
     assert ts1 == ts3
     pprint.pprint(ts4)
     assert ts1 != ts4
+
+
+def test_fitted_draw_seed():
+    """
+    fit once, draw many. same seed => same durations and order
+    """
+    s = "<60/6 stepsize:.5> cue=[1](A,B); dly=[1,2,3]; end=[1]"
+    (last_leaves, settings) = gtt.str_to_last_leaves(s, verb=0)
+    design = gtt.FittedDesign(last_leaves, settings, verb=0)
+    # draw gives a TrialArray. compare as the list of event dicts
+    (ts1, sd1) = design.draw(10)
+    (ts2, sd2) = design.draw(20)
+    (ts3, sd3) = design.draw(10)
+    (ts1, ts2, ts3) = (ts.to_triallist() for ts in (ts1, ts2, ts3))
+    assert sd1 == sd3 == 10
+    assert ts1 == ts3
+    assert ts1 != ts2
+    # durations are redrawn from the same pool each time
+    dlys = [[e['dur'] for t in ts for e in t if e['fname'] == ['dly']]
+            for ts in [ts1, ts2]]
+    assert sorted(dlys[0]) == sorted(dlys[1]) == [1, 1, 2, 2, 3, 3]
+
+
+def test_iti_slots():
+    """ remaining time is one pooled iti, split into gaps when shuffled """
+    s = "<600/10> cue=[1](A,B)"
+    (tl, settings) = gtt.str_to_triallist(s, verb=0)
+    itis = [x for x in tl if x[0]['type'] == 'iti']
+    assert len(itis) == 1
+    assert itis[0][0]['nslots'] == 59000  # (600-10)/.01
+    (ts1, sd) = shuffle_triallist(settings, tl, 1)
+    # at most one iti between each trial
+    assert len(ts1) <= 2 * 10 + 1
+    assert abs(helpers.sumdur(ts1) - 600) < .01
+
+
+def test_gap_vector():
+    import random
+    myrand = random.Random(1)
+    gaps = gap_vector(100, 5, myrand)
+    assert len(gaps) == 6
+    assert sum(gaps) == 100
+    gaps = gap_vector(100, 5, myrand, noitifirst=True)
+    assert gaps[0] == 0
+    assert sum(gaps) == 100
+
+
+def test_shuffle_tight_maxiti():
+    """ tight iti bounds find a shuffle in one pass """
+    s = "<100/10 iti:1-2> cue=[8]"
+    (tl, settings) = gtt.str_to_triallist(s, verb=0)
+    for seed in range(5):
+        (ts, sd) = shuffle_triallist(settings, tl, seed)
+        itis = iti_list(ts)
+        assert max(itis) <= 2 + 1e-6
+        assert abs(helpers.sumdur(ts) - 100) < .01
+
+
+def test_gap_vector_bounded():
+    import random
+    myrand = random.Random(1)
+    gaps = gap_vector(100, 5, myrand, maxslots=20, maxfirst=5)
+    assert sum(gaps) == 100
+    assert gaps[0] <= 5
+    assert max(gaps[1:]) <= 20
+    # cannot fit
+    assert gap_vector(100, 5, myrand, maxslots=10, maxfirst=5) is None
+
+
+def test_trialarray_roundtrip():
+    """ list of dicts -> TrialArray -> same list of dicts """
+    s = "<60/6 iti:1-8> cue=[1](A,B); dly=[1,2,3]; end=[1]"
+    (tl, settings) = gtt.str_to_triallist(s, verb=0)
+    ta = TrialArray.from_triallist(tl, settings['granularity'])
+    assert len(ta) == len(tl)
+    assert ta.to_triallist() == tl
+    # array and list shuffle the same way
+    (ts_list, _) = shuffle_triallist(settings, tl, 3)
+    (ts_arr, _) = shuffle_triallist(settings, ta, 3)
+    assert isinstance(ts_arr, TrialArray)
+    assert ts_arr.to_triallist() == ts_list
+    assert iti_list(ts_arr) == pytest.approx(iti_list(ts_list))
+
+
+def test_trialarray_take_interleave():
+    tl = [[{'fname': ['a'], 'dur': 1, 'type': 'event'}],
+          [{'fname': ['b'], 'dur': 2, 'type': 'event'},
+           {'fname': None, 'dur': .5, 'type': 'iti'}]]
+    ta = TrialArray.from_triallist(tl, .5)
+    swapped = ta.take([1, 0])
+    assert [e['fname'] for t in swapped.to_triallist() for e in t] == [['b'], None, ['a']]
+    gapped = ta.interleave([2, 0, 1])
+    assert [[e['dur'] for e in t] for t in gapped.to_triallist()] == [[1.0], [1.0], [2.0, .5], [.5]]
+    assert gapped.to_triallist()[0][0]['nslots'] == 2
+    assert gapped.iti_list() == [1.0, 1.0]
+
+
+def test_maxiterations_positional():
+    """ old callers passing maxiterations (4th, unused) get the same shuffle """
+    s = "<60/6 iti:1-8> cue=[1](A,B); dly=[1,2,3]; end=[1]"
+    (tl, settings) = gtt.str_to_triallist(s, verb=0)
+    assert shuffle_triallist(settings, tl, 3, 100) == shuffle_triallist(settings, tl, 3)